@@ -0,0 +1,49 @@
+// Cabeceras que el gateway reenvía a los microservicios y de vuelta al cliente:
+// caché condicional (ETag / If-None-Match), reintentos (Retry-After) y
+// consistencia causal entre lecturas y escrituras (X-Causal-Token)
+const REQUEST_HEADERS = ['if-none-match', 'x-causal-token'];
+const RESPONSE_HEADERS = ['etag', 'retry-after', 'x-causal-token'];
+
+// Cabeceras para la petición al microservicio
+const forwardHeaders = (req) => {
+    const headers = { Authorization: req.headers.authorization };
+    for (const name of REQUEST_HEADERS) {
+        if (req.headers[name]) {
+            headers[name] = req.headers[name];
+        }
+    }
+    return headers;
+};
+
+// Un 304 es una respuesta válida y no un error
+const validateStatus = (status) => (status >= 200 && status < 300) || status === 304;
+
+const copyHeaders = (res, response) => {
+    for (const name of RESPONSE_HEADERS) {
+        if (response.headers[name]) {
+            res.set(name, response.headers[name]);
+        }
+    }
+};
+
+// Devuelve al cliente la respuesta del microservicio con su código de estado
+const relay = (res, response) => {
+    copyHeaders(res, response);
+    if (response.status === 304) {
+        return res.status(304).end();
+    }
+    res.status(response.status).json(response.data);
+};
+
+// Devuelve el error del microservicio (p. ej. 429 o 503 con Retry-After) o un 500
+const relayError = (res, error, message) => {
+    if (error.response) {
+        copyHeaders(res, error.response);
+    }
+    res.status(error.response?.status || 500).json({
+        success: false,
+        message: error.response?.data?.message || message
+    });
+};
+
+module.exports = { forwardHeaders, validateStatus, relay, relayError };
@@ -1,29 +1,27 @@
 const express = require('express');
 const axios = require('axios');
 const { verifyToken } = require('../middleware/auth');
+const { forwardHeaders, validateStatus, relay, relayError } = require('../middleware/proxy');
 const router = express.Router();
 
 // ==================== LISTAR FACTURAS ====================
 
 router.get('/', verifyToken, async (req, res) => {
     try {
-        const token = req.headers.authorization;
         const response = await axios.get(
             `${process.env.INVOICES_SERVICE}/api/invoices`,
             {
-                headers: { Authorization: token },
+                headers: forwardHeaders(req),
                 params: req.query,
-                timeout: 5000
+                timeout: 5000,
+                validateStatus
             }
         );
 
-        res.json(response.data);
+        relay(res, response);
     } catch (error) {
         console.error('Error al conectar con Invoices Service:', error.message);
-        res.status(error.response?.status || 500).json({
-            success: false,
-            message: error.response?.data?.message || 'Error al obtener facturas'
-        });
+        relayError(res, error, 'Error al obtener facturas');
     }
 });
 
@@ -31,23 +29,20 @@ router.get('/', verifyToken, async (req, res) => {
 
 router.post('/', verifyToken, async (req, res) => {
     try {
-        const token = req.headers.authorization;
         const response = await axios.post(
             `${process.env.INVOICES_SERVICE}/api/invoices`,
             req.body,
             {
-                headers: { Authorization: token },
-                timeout: 5000
+                headers: forwardHeaders(req),
+                timeout: 5000,
+                validateStatus
             }
         );
 
-        res.status(201).json(response.data);
+        relay(res, response);
     } catch (error) {
         console.error('Error al conectar con Invoices Service:', error.message);
-        res.status(error.response?.status || 500).json({
-            success: false,
-            message: error.response?.data?.message || 'Error al crear factura'
-        });
+        relayError(res, error, 'Error al crear factura');
     }
 });
 
@@ -55,22 +50,19 @@ router.post('/', verifyToken, async (req, res) => {
 
 router.get('/:id', verifyToken, async (req, res) => {
     try {
-        const token = req.headers.authorization;
         const response = await axios.get(
             `${process.env.INVOICES_SERVICE}/api/invoices/${req.params.id}`,
             {
-                headers: { Authorization: token },
-                timeout: 5000
+                headers: forwardHeaders(req),
+                timeout: 5000,
+                validateStatus
             }
         );
 
-        res.json(response.data);
+        relay(res, response);
     } catch (error) {
         console.error('Error al conectar con Invoices Service:', error.message);
-        res.status(error.response?.status || 500).json({
-            success: false,
-            message: error.response?.data?.message || 'Error al obtener factura'
-        });
+        relayError(res, error, 'Error al obtener factura');
     }
 });
 
@@ -78,23 +70,20 @@ router.get('/:id', verifyToken, async (req, res) => {
 
 router.put('/:id', verifyToken, async (req, res) => {
     try {
-        const token = req.headers.authorization;
         const response = await axios.put(
             `${process.env.INVOICES_SERVICE}/api/invoices/${req.params.id}`,
             req.body,
             {
-                headers: { Authorization: token },
-                timeout: 5000
+                headers: forwardHeaders(req),
+                timeout: 5000,
+                validateStatus
             }
         );
 
-        res.json(response.data);
+        relay(res, response);
     } catch (error) {
         console.error('Error al conectar con Invoices Service:', error.message);
-        res.status(error.response?.status || 500).json({
-            success: false,
-            message: error.response?.data?.message || 'Error al actualizar factura'
-        });
+        relayError(res, error, 'Error al actualizar factura');
     }
 });
 
@@ -102,23 +91,20 @@ router.put('/:id', verifyToken, async (req, res) => {
 
 router.patch('/:id/pay', verifyToken, async (req, res) => {
     try {
-        const token = req.headers.authorization;
         const response = await axios.patch(
             `${process.env.INVOICES_SERVICE}/api/invoices/${req.params.id}/pay`,
             {},
             {
-                headers: { Authorization: token },
-                timeout: 5000
+                headers: forwardHeaders(req),
+                timeout: 5000,
+                validateStatus
             }
         );
 
-        res.json(response.data);
+        relay(res, response);
     } catch (error) {
         console.error('Error al conectar con Invoices Service:', error.message);
-        res.status(error.response?.status || 500).json({
-            success: false,
-            message: error.response?.data?.message || 'Error al marcar factura como pagada'
-        });
+        relayError(res, error, 'Error al marcar factura como pagada');
     }
 });
 
@@ -126,22 +112,19 @@ router.patch('/:id/pay', verifyToken, async (req, res) => {
 
 router.delete('/:id', verifyToken, async (req, res) => {
     try {
-        const token = req.headers.authorization;
         const response = await axios.delete(
             `${process.env.INVOICES_SERVICE}/api/invoices/${req.params.id}`,
             {
-                headers: { Authorization: token },
-                timeout: 5000
+                headers: forwardHeaders(req),
+                timeout: 5000,
+                validateStatus
             }
         );
 
-        res.json(response.data);
+        relay(res, response);
     } catch (error) {
         console.error('Error al conectar con Invoices Service:', error.message);
-        res.status(error.response?.status || 500).json({
-            success: false,
-            message: error.response?.data?.message || 'Error al eliminar factura'
-        });
+        relayError(res, error, 'Error al eliminar factura');
     }
 });
 
@@ -1,29 +1,27 @@
 const express = require('express');
 const axios = require('axios');
 const { verifyToken } = require('../middleware/auth');
+const { forwardHeaders, validateStatus, relay, relayError } = require('../middleware/proxy');
 const router = express.Router();
 
 // ==================== LISTAR ÓRDENES ====================
 
 router.get('/', verifyToken, async (req, res) => {
     try {
-        const token = req.headers.authorization;
         const response = await axios.get(
             `${process.env.WORKORDERS_SERVICE}/api/workorders`,
             {
-                headers: { Authorization: token },
+                headers: forwardHeaders(req),
                 params: req.query,
-                timeout: 5000
+                timeout: 5000,
+                validateStatus
             }
         );
 
-        res.json(response.data);
+        relay(res, response);
     } catch (error) {
         console.error('Error al conectar con Workorders Service:', error.message);
-        res.status(error.response?.status || 500).json({
-            success: false,
-            message: error.response?.data?.message || 'Error al obtener órdenes'
-        });
+        relayError(res, error, 'Error al obtener órdenes');
     }
 });
 
@@ -31,23 +29,20 @@ router.get('/', verifyToken, async (req, res) => {
 
 router.post('/', verifyToken, async (req, res) => {
     try {
-        const token = req.headers.authorization;
         const response = await axios.post(
             `${process.env.WORKORDERS_SERVICE}/api/workorders`,
             req.body,
             {
-                headers: { Authorization: token },
-                timeout: 5000
+                headers: forwardHeaders(req),
+                timeout: 5000,
+                validateStatus
             }
         );
 
-        res.status(201).json(response.data);
+        relay(res, response);
     } catch (error) {
         console.error('Error al conectar con Workorders Service:', error.message);
-        res.status(error.response?.status || 500).json({
-            success: false,
-            message: error.response?.data?.message || 'Error al crear orden'
-        });
+        relayError(res, error, 'Error al crear orden');
     }
 });
 
@@ -55,22 +50,19 @@ router.post('/', verifyToken, async (req, res) => {
 
 router.get('/:id', verifyToken, async (req, res) => {
     try {
-        const token = req.headers.authorization;
         const response = await axios.get(
             `${process.env.WORKORDERS_SERVICE}/api/workorders/${req.params.id}`,
             {
-                headers: { Authorization: token },
-                timeout: 5000
+                headers: forwardHeaders(req),
+                timeout: 5000,
+                validateStatus
             }
         );
 
-        res.json(response.data);
+        relay(res, response);
     } catch (error) {
         console.error('Error al conectar con Workorders Service:', error.message);
-        res.status(error.response?.status || 500).json({
-            success: false,
-            message: error.response?.data?.message || 'Error al obtener orden'
-        });
+        relayError(res, error, 'Error al obtener orden');
     }
 });
 
@@ -78,23 +70,20 @@ router.get('/:id', verifyToken, async (req, res) => {
 
 router.put('/:id', verifyToken, async (req, res) => {
     try {
-        const token = req.headers.authorization;
         const response = await axios.put(
             `${process.env.WORKORDERS_SERVICE}/api/workorders/${req.params.id}`,
             req.body,
             {
-                headers: { Authorization: token },
-                timeout: 5000
+                headers: forwardHeaders(req),
+                timeout: 5000,
+                validateStatus
             }
         );
 
-        res.json(response.data);
+        relay(res, response);
     } catch (error) {
         console.error('Error al conectar con Workorders Service:', error.message);
-        res.status(error.response?.status || 500).json({
-            success: false,
-            message: error.response?.data?.message || 'Error al actualizar orden'
-        });
+        relayError(res, error, 'Error al actualizar orden');
     }
 });
 
@@ -102,23 +91,20 @@ router.put('/:id', verifyToken, async (req, res) => {
 
 router.patch('/:id/assign', verifyToken, async (req, res) => {
     try {
-        const token = req.headers.authorization;
         const response = await axios.patch(
             `${process.env.WORKORDERS_SERVICE}/api/workorders/${req.params.id}/assign`,
             req.body,
             {
-                headers: { Authorization: token },
-                timeout: 5000
+                headers: forwardHeaders(req),
+                timeout: 5000,
+                validateStatus
             }
         );
 
-        res.json(response.data);
+        relay(res, response);
     } catch (error) {
         console.error('Error al conectar con Workorders Service:', error.message);
-        res.status(error.response?.status || 500).json({
-            success: false,
-            message: error.response?.data?.message || 'Error al asignar técnico'
-        });
+        relayError(res, error, 'Error al asignar técnico');
     }
 });
 
@@ -126,23 +112,20 @@ router.patch('/:id/assign', verifyToken, async (req, res) => {
 
 router.patch('/:id/status', verifyToken, async (req, res) => {
     try {
-        const token = req.headers.authorization;
         const response = await axios.patch(
             `${process.env.WORKORDERS_SERVICE}/api/workorders/${req.params.id}/status`,
             req.body,
             {
-                headers: { Authorization: token },
-                timeout: 5000
+                headers: forwardHeaders(req),
+                timeout: 5000,
+                validateStatus
             }
         );
 
-        res.json(response.data);
+        relay(res, response);
     } catch (error) {
         console.error('Error al conectar con Workorders Service:', error.message);
-        res.status(error.response?.status || 500).json({
-            success: false,
-            message: error.response?.data?.message || 'Error al cambiar estado'
-        });
+        relayError(res, error, 'Error al cambiar estado');
     }
 });
 
@@ -150,23 +133,20 @@ router.patch('/:id/status', verifyToken, async (req, res) => {
 
 router.post('/:id/tasks', verifyToken, async (req, res) => {
     try {
-        const token = req.headers.authorization;
         const response = await axios.post(
             `${process.env.WORKORDERS_SERVICE}/api/workorders/${req.params.id}/add-task`,
             req.body,
             {
-                headers: { Authorization: token },
-                timeout: 5000
+                headers: forwardHeaders(req),
+                timeout: 5000,
+                validateStatus
             }
         );
 
-        res.json(response.data);
+        relay(res, response);
     } catch (error) {
         console.error('Error al conectar con Workorders Service:', error.message);
-        res.status(error.response?.status || 500).json({
-            success: false,
-            message: error.response?.data?.message || 'Error al agregar tarea'
-        });
+        relayError(res, error, 'Error al agregar tarea');
     }
 });
 
@@ -174,22 +154,19 @@ router.post('/:id/tasks', verifyToken, async (req, res) => {
 
 router.delete('/:id', verifyToken, async (req, res) => {
     try {
-        const token = req.headers.authorization;
         const response = await axios.delete(
             `${process.env.WORKORDERS_SERVICE}/api/workorders/${req.params.id}`,
             {
-                headers: { Authorization: token },
-                timeout: 5000
+                headers: forwardHeaders(req),
+                timeout: 5000,
+                validateStatus
             }
         );
 
-        res.json(response.data);
+        relay(res, response);
     } catch (error) {
         console.error('Error al conectar con Workorders Service:', error.message);
-        res.status(error.response?.status || 500).json({
-            success: false,
-            message: error.response?.data?.message || 'Error al eliminar orden'
-        });
+        relayError(res, error, 'Error al eliminar orden');
     }
 });
 
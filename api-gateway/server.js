@@ -14,7 +14,9 @@ app.use(helmet());
 // CORS
 app.use(cors({
     origin: process.env.CORS_ORIGIN || '*',
-    credentials: true
+    credentials: true,
+    // Cabeceras de los microservicios que el navegador debe poder leer
+    exposedHeaders: ['ETag', 'Retry-After', 'X-Causal-Token']
 }));
 
 // Body parser
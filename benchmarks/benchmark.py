@@ -0,0 +1,660 @@
+"""Banco de pruebas de carga para los microservicios de órdenes y facturación.
+
+Subcomandos:
+    seed      Pobla MongoDB con órdenes (con tareas) y facturas (con ítems) realistas
+    run       Ejecuta una mezcla concurrente de peticiones sobre todas las rutas
+    compare   Compara dos resultados JSON de run, ruta por ruta
+
+Ejemplos:
+    python benchmark.py seed --workorders 1000000 --invoices 1000000 --drop
+    python benchmark.py run --duration 60 --concurrency 32 --output base.json
+    python benchmark.py run --mix '{"*.index_report": 0, "ordenes.get": 50}' --output cambio.json
+    python benchmark.py compare base.json cambio.json
+
+Los datos se generan con una semilla fija (--seed), de modo que dos ejecuciones
+con los mismos parámetros producen el mismo conjunto de datos y la misma
+secuencia de peticiones por worker.
+
+Los servicios limitan las peticiones por usuario (RATE_LIMIT_READ, RATE_LIMIT_WRITE
+y RATE_LIMIT_BULK). Para medir capacidad y no el límite, levántelos con los límites
+desactivados:
+
+    RATE_LIMIT_READ=0 RATE_LIMIT_WRITE=0 RATE_LIMIT_BULK=0 docker compose up
+
+Las respuestas 429 se cuentan aparte (rate_limited) y no entran en los percentiles
+de latencia; run avisa si hubo alguna.
+"""
+import argparse
+import fnmatch
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime, timedelta, timezone
+
+import jwt
+import requests
+from pymongo import MongoClient
+
+# ==================== CONFIGURACIÓN ====================
+
+MONGO_URI = os.getenv('MONGO_URI', 'mongodb://localhost:27017/')
+ORDERS_DB_NAME = os.getenv('ORDERS_DB_NAME', 'orders_db')
+BILLING_DB_NAME = os.getenv('BILLING_DB_NAME', 'billing_db')
+JWT_SECRET = os.getenv('JWT_SECRET', 'secret')
+ORDENES_URL = os.getenv('ORDENES_URL', 'http://localhost:5001')
+FACTURACION_URL = os.getenv('FACTURACION_URL', 'http://localhost:5000')
+
+# ==================== GENERACIÓN DE DATOS ====================
+
+WORDS = [
+    'revisión', 'mantenimiento', 'preventivo', 'correctivo', 'instalación', 'cambio',
+    'bomba', 'caldera', 'filtro', 'fuga', 'tablero', 'eléctrico', 'aire', 'acondicionado',
+    'compresor', 'válvula', 'tubería', 'sensor', 'motor', 'calibración', 'limpieza',
+    'ducto', 'ventilador', 'termostato', 'medidor', 'cableado', 'iluminación',
+    'generador', 'tanque', 'ascensor', 'cerradura', 'alarma', 'cámara', 'red', 'servidor'
+]
+STREETS = ['Calle', 'Carrera', 'Avenida', 'Transversal', 'Diagonal']
+CITIES = ['Bogotá', 'Medellín', 'Cali', 'Barranquilla', 'Bucaramanga', 'Pereira', 'Manizales']
+COMPANY_SUFFIXES = ['S.A.S.', 'Ltda.', 'S.A.', 'y Cía.']
+
+WORKORDER_STATES = ['pendiente', 'en_progreso', 'completada', 'cancelada']
+WORKORDER_STATE_WEIGHTS = [30, 20, 45, 5]
+INVOICE_STATES = ['pendiente', 'pagada', 'cancelada']
+INVOICE_STATE_WEIGHTS = [30, 65, 5]
+PRIORITIES = ['baja', 'media', 'alta']
+
+# Antigüedad máxima de los documentos generados
+HISTORY_DAYS = 730
+
+def phrase(rng, size):
+    """Frase de mantenimiento con palabras del vocabulario"""
+    return ' '.join(rng.choice(WORDS) for _ in range(size)).capitalize()
+
+def client_ref(rng, clients):
+    """Cliente (id, nombre) tomado de un conjunto acotado y estable"""
+    n = rng.randrange(clients)
+    return f'CLI-{n:05d}', f'Cliente {n:05d} {COMPANY_SUFFIXES[n % len(COMPANY_SUFFIXES)]}'
+
+def technician_ref(rng, technicians):
+    """Identificador de técnico de un conjunto acotado y estable"""
+    return f'TEC-{rng.randrange(technicians):03d}'
+
+def workorder_payload(rng, number, clients, technicians):
+    """Cuerpo de POST /api/workorders"""
+    cliente_id, cliente_nombre = client_ref(rng, clients)
+    return {
+        'numero_orden': f'OT-{number:08d}',
+        'cliente_id': cliente_id,
+        'cliente_nombre': cliente_nombre,
+        'descripcion': phrase(rng, rng.randint(4, 12)),
+        'prioridad': rng.choice(PRIORITIES),
+        'tecnico_asignado': technician_ref(rng, technicians) if rng.random() < 0.8 else None,
+        'horas_estimadas': rng.choice([1, 2, 4, 8, 16]),
+        'notas': phrase(rng, rng.randint(0, 20)),
+        'ubicacion': f'{rng.choice(STREETS)} {rng.randint(1, 200)} # {rng.randint(1, 99)}-{rng.randint(1, 99)}, {rng.choice(CITIES)}',
+        'telefonos_contacto': [f'3{rng.randint(100000000, 199999999)}' for _ in range(rng.randint(0, 2))]
+    }
+
+def invoice_payload(rng, number, clients):
+    """Cuerpo de POST /api/invoices"""
+    cliente_id, cliente_nombre = client_ref(rng, clients)
+    return {
+        'numero_factura': f'FV-{number:08d}',
+        'cliente_id': cliente_id,
+        'cliente_nombre': cliente_nombre,
+        'items': [{
+            'descripcion': phrase(rng, rng.randint(2, 6)),
+            'cantidad': rng.randint(1, 20),
+            'precio_unitario': round(rng.uniform(5, 2000), 2)
+        } for _ in range(rng.randint(1, 10))],
+        'notas': phrase(rng, rng.randint(0, 12))
+    }
+
+def random_date(rng, now):
+    """Fecha de creación uniforme dentro de la ventana histórica"""
+    return now - timedelta(seconds=rng.uniform(0, HISTORY_DAYS * 86400))
+
+def make_workorder(rng, number, now, clients, technicians):
+    """Documento de orden de trabajo con la misma forma que build_workorder y tareas realistas"""
+    created = random_date(rng, now)
+    estado = rng.choices(WORKORDER_STATES, WORKORDER_STATE_WEIGHTS)[0]
+    document = workorder_payload(rng, number, clients, technicians)
+    started = created + timedelta(hours=rng.uniform(1, 72)) if estado in ('en_progreso', 'completada') else None
+    finished = started + timedelta(hours=rng.uniform(1, 48)) if estado == 'completada' else None
+    
+    tareas = []
+    for _ in range(rng.randint(0, 8)):
+        completada = estado == 'completada' or rng.random() < 0.3
+        tareas.append({
+            'id': format(rng.getrandbits(96), '024x'),
+            'descripcion': phrase(rng, rng.randint(2, 6)),
+            'estado': 'completada' if completada else 'pendiente',
+            'fecha_creacion': created + timedelta(minutes=rng.uniform(0, 600)),
+            'completada': completada
+        })
+    
+    document.update({
+        'estado': estado,
+        'usuario_creador_id': rng.randint(1, 50),
+        'fecha_creacion': created,
+        'fecha_programada': (created + timedelta(days=rng.randint(0, 14))).isoformat(),
+        'fecha_inicio': started,
+        'fecha_finalizacion': finished,
+        'horas_trabajadas': round(rng.uniform(0, document['horas_estimadas'] * 1.5), 1) if started else 0,
+        'tareas': tareas
+    })
+    return document
+
+def make_invoice(rng, number, now, clients):
+    """Documento de factura con la misma forma y totales que build_invoice"""
+    created = random_date(rng, now)
+    estado = rng.choices(INVOICE_STATES, INVOICE_STATE_WEIGHTS)[0]
+    document = invoice_payload(rng, number, clients)
+    subtotal = sum(item['cantidad'] * item['precio_unitario'] for item in document['items'])
+    iva = subtotal * 0.19
+    
+    document.update({
+        'subtotal': subtotal,
+        'iva': iva,
+        'total': subtotal + iva,
+        'estado': estado,
+        'usuario_id': rng.randint(1, 50),
+        'fecha_creacion': created,
+        'fecha_pago': created + timedelta(days=rng.randint(0, 60)) if estado == 'pagada' else None
+    })
+    return document
+
+# ==================== SEED ====================
+
+def insert_generated(collection, total, batch_size, factory):
+    """Inserta total documentos generados por factory(n) en lotes, mostrando el avance"""
+    started = time.perf_counter()
+    batch = []
+    for number in range(1, total + 1):
+        batch.append(factory(number))
+        if len(batch) >= batch_size or number == total:
+            collection.insert_many(batch, ordered=False)
+            batch = []
+            rate = number / (time.perf_counter() - started)
+            print(f'\r{collection.name}: {number}/{total} ({rate:.0f} docs/s)', end='', file=sys.stderr)
+    if total:
+        print(file=sys.stderr)
+
+def seed(args):
+    """Pobla las bases de órdenes y facturación con datos reproducibles"""
+    client = MongoClient(args.mongo_uri)
+    workorders = client[args.orders_db]['workorders']
+    invoices = client[args.billing_db]['invoices']
+    now = datetime.now(timezone.utc)
+    
+    if args.drop:
+        # Los archivos también: include_archived mezclaría datos de cargas anteriores
+        workorders.delete_many({})
+        invoices.delete_many({})
+        client[args.orders_db]['workorders_archive'].delete_many({})
+        client[args.billing_db]['invoices_archive'].delete_many({})
+    
+    rng = random.Random(args.seed)
+    insert_generated(workorders, args.workorders, args.batch_size,
+                     lambda n: make_workorder(rng, n, now, args.clients, args.technicians))
+    rng = random.Random(args.seed + 1)
+    insert_generated(invoices, args.invoices, args.batch_size,
+                     lambda n: make_invoice(rng, n, now, args.clients))
+    
+    # Los contadores incrementales quedan desactualizados tras una carga directa
+    client[args.orders_db]['technician_workload'].delete_many({})
+    client[args.billing_db]['invoice_rollups'].delete_many({})
+    print('Contadores vaciados. Reconstruirlos con:\n'
+          '  (microservicio-ordenes)     flask --app app rebuild-workload\n'
+          '  (microservicio-facturacion) flask --app app rebuild-rollups', file=sys.stderr)
+
+# ==================== ESCENARIOS ====================
+
+class RunContext:
+    """Estado compartido por los workers: muestras de datos existentes e ids creados en la corrida"""
+    
+    def __init__(self, args):
+        self.args = args
+        self.samples = {}
+        self.tokens = []
+        self.created = {'ordenes': deque(maxlen=100000), 'facturacion': deque(maxlen=100000)}
+        # (orden, ids de tareas) agregadas en la corrida, para completarlas después
+        self.tasks = deque(maxlen=100000)
+        self._counter = iter(range(10 ** 8, 10 ** 9))
+        self._lock = threading.Lock()
+    
+    def next_number(self):
+        """Número único para los documentos creados durante la corrida"""
+        with self._lock:
+            return next(self._counter)
+    
+    def sample_id(self, service, rng):
+        return rng.choice(self.samples[service]['ids'])
+    
+    def sample_value(self, service, field, rng):
+        values = self.samples[service][field]
+        return rng.choice(values) if values else None
+    
+    def sample_ids(self, service, rng, size):
+        ids = self.samples[service]['ids']
+        return rng.sample(ids, min(size, len(ids)))
+
+def list_filters(ctx, service, rng):
+    """Combinación aleatoria de los filtros por igualdad del listado"""
+    params = {}
+    if rng.random() < 0.5:
+        params['estado'] = rng.choice(WORKORDER_STATES if service == 'ordenes' else INVOICE_STATES)
+    if rng.random() < 0.3:
+        params['cliente_id'] = ctx.sample_value(service, 'cliente_id', rng)
+    if service == 'ordenes' and rng.random() < 0.3:
+        params['tecnico_asignado'] = ctx.sample_value(service, 'tecnico_asignado', rng)
+    return {key: value for key, value in params.items() if value}
+
+def month_range(rng):
+    """Parámetros desde/hasta de un mes calendario dentro de la ventana histórica"""
+    day = datetime.now(timezone.utc) - timedelta(days=rng.uniform(0, HISTORY_DAYS))
+    start = day.date().replace(day=1)
+    end = (start + timedelta(days=32)).replace(day=1)
+    return {'desde': start.isoformat(), 'hasta': end.isoformat()}
+
+def remember_created(service):
+    """Callback que guarda los ids creados para las rutas que los consumen (p. ej. DELETE)"""
+    def on_response(ctx, response):
+        if response.status_code in (201, 207):
+            data = response.json().get('data')
+            if isinstance(data, dict) and '_id' in data:
+                ctx.created[service].append(data['_id'])
+            elif isinstance(data, dict):
+                ctx.created[service].extend(item['_id'] for item in data.get('results', []) if item.get('_id'))
+    return on_response
+
+def remember_tasks(order_id):
+    """Callback que guarda las tareas agregadas a order_id para la ruta de completado"""
+    def on_response(ctx, response):
+        if response.status_code == 201:
+            ctx.tasks.append((order_id, [task['id'] for task in response.json().get('data', [])]))
+    return on_response
+
+def batch_get_body(ctx, service, rng):
+    """Cuerpo de batch-get: ids muestreados o varios clientes"""
+    clientes = ctx.samples[service]['cliente_id']
+    if clientes and rng.random() < 0.2:
+        return {'cliente_id': rng.sample(clientes, min(rng.randint(1, 5), len(clientes)))}
+    return {'ids': ctx.sample_ids(service, rng, rng.randint(5, 50))}
+
+def request_spec(method, path, params=None, body=None, stream=False, on_response=None):
+    return {'method': method, 'path': path, 'params': params, 'json': body, 'stream': stream, 'on_response': on_response}
+
+def ordenes_routes():
+    """Escenarios sobre cada ruta de microservicio-ordenes con su peso por defecto"""
+    base = '/api/workorders'
+    
+    def item(ctx, rng):
+        return f"{base}/{ctx.sample_id('ordenes', rng)}"
+    
+    def new_workorder(ctx, rng):
+        return workorder_payload(rng, ctx.next_number(), ctx.args.clients, ctx.args.technicians)
+    
+    def delete(ctx, rng):
+        try:
+            return request_spec('DELETE', f"{base}/{ctx.created['ordenes'].popleft()}")
+        except IndexError:
+            return None
+    
+    def add_tasks(ctx, rng):
+        path = item(ctx, rng)
+        return request_spec('POST', f'{path}/tasks', body=[{'descripcion': phrase(rng, 4)} for _ in range(rng.randint(1, 5))],
+                            on_response=remember_tasks(path.rsplit('/', 1)[1]))
+    
+    def complete_tasks(ctx, rng):
+        try:
+            order_id, task_ids = ctx.tasks.popleft()
+        except IndexError:
+            return None
+        return request_spec('PATCH', f'{base}/{order_id}/tasks/complete', body={'ids': task_ids, 'completada': True})
+    
+    return {
+        'health': (1, lambda ctx, rng: request_spec('GET', '/api/health')),
+        'list': (20, lambda ctx, rng: request_spec('GET', base, {
+            'page': rng.randint(1, 50), 'per_page': 20, **list_filters(ctx, 'ordenes', rng)})),
+        'list_cursor': (10, lambda ctx, rng: request_spec('GET', base, {
+            'cursor': '', 'per_page': 20, **list_filters(ctx, 'ordenes', rng)})),
+        'search': (5, lambda ctx, rng: request_spec('GET', base, {'q': rng.choice(WORDS), 'per_page': 20})),
+        'list_month': (3, lambda ctx, rng: request_spec('GET', base, {
+            'cursor': '', 'per_page': 20, **month_range(rng), **list_filters(ctx, 'ordenes', rng)})),
+        'get': (25, lambda ctx, rng: request_spec('GET', item(ctx, rng))),
+        'create': (5, lambda ctx, rng: request_spec('POST', base, body=new_workorder(ctx, rng),
+                                                    on_response=remember_created('ordenes'))),
+        'bulk': (1, lambda ctx, rng: request_spec('POST', f'{base}/bulk', body=[new_workorder(ctx, rng) for _ in range(50)],
+                                                  on_response=remember_created('ordenes'))),
+        'update': (4, lambda ctx, rng: request_spec('PUT', item(ctx, rng), body={
+            'notas': phrase(rng, 8), 'horas_trabajadas': rng.randint(0, 20)})),
+        'assign': (2, lambda ctx, rng: request_spec('PATCH', f'{item(ctx, rng)}/assign', body={
+            'tecnico_asignado': technician_ref(rng, ctx.args.technicians)})),
+        'status': (3, lambda ctx, rng: request_spec('PATCH', f'{item(ctx, rng)}/status', body={
+            'estado': rng.choices(WORKORDER_STATES, WORKORDER_STATE_WEIGHTS)[0]})),
+        'add_task': (3, lambda ctx, rng: request_spec('POST', f'{item(ctx, rng)}/add-task', body={
+            'descripcion': phrase(rng, 4)})),
+        'tasks': (3, lambda ctx, rng: request_spec('GET', f'{item(ctx, rng)}/tasks', {
+            'per_page': 20, **({'completada': rng.choice(['true', 'false'])} if rng.random() < 0.3 else {})})),
+        'add_tasks': (2, add_tasks),
+        'complete_tasks': (2, complete_tasks),
+        'batch_get': (3, lambda ctx, rng: request_spec('POST', f'{base}/batch-get', body=batch_get_body(ctx, 'ordenes', rng))),
+        'delete': (2, delete),
+        'export': (1, lambda ctx, rng: request_spec('GET', f'{base}/export', {
+            'format': rng.choice(['ndjson', 'csv']), 'cliente_id': ctx.sample_value('ordenes', 'cliente_id', rng)})),
+        'workload': (2, lambda ctx, rng: request_spec('GET', f'{base}/workload')),
+        'events': (1, lambda ctx, rng: request_spec('GET', f'{base}/events', list_filters(ctx, 'ordenes', rng), stream=True)),
+        'metrics': (1, lambda ctx, rng: request_spec('GET', '/api/metrics')),
+        'token_cache': (1, lambda ctx, rng: request_spec('GET', '/api/diagnostics/token-cache')),
+        'index_report': (0.1, lambda ctx, rng: request_spec('GET', '/api/diagnostics/indexes', {'limit': 5}))
+    }
+
+def facturacion_routes():
+    """Escenarios sobre cada ruta de microservicio-facturacion con su peso por defecto"""
+    base = '/api/invoices'
+    
+    def item(ctx, rng):
+        return f"{base}/{ctx.sample_id('facturacion', rng)}"
+    
+    def new_invoice(ctx, rng):
+        return invoice_payload(rng, ctx.next_number(), ctx.args.clients)
+    
+    def delete(ctx, rng):
+        try:
+            return request_spec('DELETE', f"{base}/{ctx.created['facturacion'].popleft()}")
+        except IndexError:
+            return None
+    
+    return {
+        'health': (1, lambda ctx, rng: request_spec('GET', '/api/health')),
+        'list': (20, lambda ctx, rng: request_spec('GET', base, {
+            'page': rng.randint(1, 50), 'per_page': 20, **list_filters(ctx, 'facturacion', rng)})),
+        'list_cursor': (10, lambda ctx, rng: request_spec('GET', base, {
+            'cursor': '', 'per_page': 20, **list_filters(ctx, 'facturacion', rng)})),
+        'search': (5, lambda ctx, rng: request_spec('GET', base, {'q': rng.choice(WORDS), 'per_page': 20})),
+        'list_month': (3, lambda ctx, rng: request_spec('GET', base, {
+            'cursor': '', 'per_page': 20, **month_range(rng), **list_filters(ctx, 'facturacion', rng)})),
+        'get': (25, lambda ctx, rng: request_spec('GET', item(ctx, rng))),
+        'create': (5, lambda ctx, rng: request_spec('POST', base, body=new_invoice(ctx, rng),
+                                                    on_response=remember_created('facturacion'))),
+        'bulk': (1, lambda ctx, rng: request_spec('POST', f'{base}/bulk', body=[new_invoice(ctx, rng) for _ in range(50)],
+                                                  on_response=remember_created('facturacion'))),
+        'update': (4, lambda ctx, rng: request_spec('PUT', item(ctx, rng), body={'notas': phrase(rng, 8)})),
+        'pay': (3, lambda ctx, rng: request_spec('PATCH', f'{item(ctx, rng)}/pay')),
+        'batch_get': (3, lambda ctx, rng: request_spec('POST', f'{base}/batch-get', body=batch_get_body(ctx, 'facturacion', rng))),
+        'delete': (2, delete),
+        'export': (1, lambda ctx, rng: request_spec('GET', f'{base}/export', {
+            'format': rng.choice(['ndjson', 'csv']), 'cliente_id': ctx.sample_value('facturacion', 'cliente_id', rng)})),
+        'report': (3, lambda ctx, rng: request_spec('GET', f'{base}/report', {
+            'group_by': rng.choice(['estado', 'mes', 'cliente_id,estado'])})),
+        'events': (1, lambda ctx, rng: request_spec('GET', f'{base}/events', list_filters(ctx, 'facturacion', rng), stream=True)),
+        'metrics': (1, lambda ctx, rng: request_spec('GET', '/api/metrics')),
+        'token_cache': (1, lambda ctx, rng: request_spec('GET', '/api/diagnostics/token-cache')),
+        'index_report': (0.1, lambda ctx, rng: request_spec('GET', '/api/diagnostics/indexes', {'limit': 5}))
+    }
+
+def build_mix(overrides):
+    """Rutas y pesos efectivos: los de por defecto con los patrones de --mix aplicados en orden"""
+    routes = {}
+    for service, table in [('ordenes', ordenes_routes()), ('facturacion', facturacion_routes())]:
+        for name, (weight, builder) in table.items():
+            routes[f'{service}.{name}'] = [weight, builder]
+    
+    for pattern, weight in overrides.items():
+        matched = fnmatch.filter(routes, pattern)
+        if not matched:
+            raise SystemExit(f'--mix: el patrón {pattern!r} no coincide con ninguna ruta')
+        for name in matched:
+            routes[name][0] = weight
+    
+    return {name: (weight, builder) for name, (weight, builder) in routes.items() if weight > 0}
+
+def load_samples(ctx, service, base_url, path, fields, headers):
+    """Obtiene una muestra de documentos existentes (ids y valores de filtro) vía la API"""
+    # Se recorren páginas por cursor porque el servicio acota per_page
+    documents, cursor = [], ''
+    while cursor is not None and len(documents) < ctx.args.sample_size:
+        response = requests.get(f'{base_url}{path}', params={
+            'cursor': cursor, 'per_page': min(ctx.args.sample_size - len(documents), 100), 'fields': ','.join(fields)
+        }, headers=headers, timeout=60)
+        response.raise_for_status()
+        page = response.json()
+        documents.extend(page['data'])
+        cursor = page['pagination']['next_cursor']
+    
+    if not documents:
+        raise SystemExit(f'{service}: no hay documentos; ejecute primero "seed"')
+    
+    ctx.samples[service] = {'ids': [document['_id'] for document in documents]}
+    for field in fields:
+        ctx.samples[service][field] = sorted({document[field] for document in documents if document.get(field)})
+
+# ==================== EJECUCIÓN ====================
+
+def mint_token(secret, user_id, ttl):
+    """Token HS256 equivalente a los que emite el Auth Service"""
+    now = int(time.time())
+    return jwt.encode({
+        'id': user_id,
+        'sub': str(user_id),
+        'email': f'benchmark{user_id}@example.com',
+        'iat': now,
+        'exp': now + ttl
+    }, secret, algorithm='HS256')
+
+def worker(ctx, routes, weights, index, measure_from, deadline, samples):
+    """Ciclo de un worker: elige una ruta según los pesos, la ejecuta y registra su latencia"""
+    rng = random.Random(ctx.args.seed * 1000 + index)
+    session = requests.Session()
+    session.headers['Authorization'] = f'Bearer {ctx.tokens[index % len(ctx.tokens)]}'
+    names = list(routes)
+    
+    while time.perf_counter() < deadline:
+        name = rng.choices(names, weights)[0]
+        spec = routes[name][1](ctx, rng)
+        if spec is None:
+            continue
+        
+        base_url = ctx.args.ordenes_url if name.startswith('ordenes.') else ctx.args.facturacion_url
+        started = time.perf_counter()
+        try:
+            response = session.request(
+                spec['method'], f"{base_url}{spec['path']}",
+                params=spec['params'], json=spec['json'],
+                stream=spec['stream'], timeout=ctx.args.timeout
+            )
+            status = response.status_code
+            # En SSE se mide el tiempo hasta recibir las cabeceras del stream
+            if spec['stream']:
+                response.close()
+        except requests.RequestException:
+            response, status = None, 0
+        elapsed = time.perf_counter() - started
+        
+        if started >= measure_from:
+            samples.append((name, status, elapsed))
+        if response is not None and spec['on_response']:
+            try:
+                spec['on_response'](ctx, response)
+            except ValueError:
+                pass
+
+def percentile(sorted_values, fraction):
+    """Percentil por rango más cercano sobre una lista ordenada"""
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return round(sorted_values[rank], 3)
+
+def summarize(samples, duration):
+    """Throughput, códigos de estado y percentiles de latencia (ms) de un conjunto de muestras"""
+    # Un 429 se rechaza antes de llegar a la ruta: su latencia no es la de la ruta
+    latencies = sorted(elapsed * 1000 for _, status, elapsed in samples if status != 429)
+    statuses = Counter(status for _, status, _ in samples)
+    return {
+        'requests': len(samples),
+        # 0 = error de conexión o timeout
+        'errors': sum(count for status, count in statuses.items() if status == 0 or status >= 500),
+        'rate_limited': statuses[429],
+        'status_codes': {str(status): count for status, count in sorted(statuses.items())},
+        'throughput_rps': round(len(samples) / duration, 2) if duration else None,
+        'latency_ms': {
+            'mean': round(sum(latencies) / len(latencies), 3) if latencies else None,
+            'p50': percentile(latencies, 0.50),
+            'p95': percentile(latencies, 0.95),
+            'p99': percentile(latencies, 0.99),
+            'max': round(latencies[-1], 3) if latencies else None
+        }
+    }
+
+def git_revision():
+    """Commit del árbol que se está midiendo, si está disponible"""
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(args):
+    """Ejecuta la mezcla de peticiones y emite el resultado en JSON"""
+    overrides = json.loads(open(args.mix[1:]).read() if args.mix.startswith('@') else args.mix)
+    routes = build_mix(overrides)
+    weights = [weight for weight, _ in routes.values()]
+    
+    ctx = RunContext(args)
+    ttl = int(args.warmup + args.duration) + 3600
+    ctx.tokens = [mint_token(args.jwt_secret, user_id, ttl) for user_id in range(1, args.users + 1)]
+    headers = {'Authorization': f'Bearer {ctx.tokens[0]}'}
+    load_samples(ctx, 'ordenes', args.ordenes_url, '/api/workorders', ['cliente_id', 'tecnico_asignado'], headers)
+    load_samples(ctx, 'facturacion', args.facturacion_url, '/api/invoices', ['cliente_id'], headers)
+    
+    started_at = datetime.now(timezone.utc).isoformat()
+    measure_from = time.perf_counter() + args.warmup
+    deadline = measure_from + args.duration
+    per_worker = [[] for _ in range(args.concurrency)]
+    threads = [
+        threading.Thread(target=worker, args=(ctx, routes, weights, index, measure_from, deadline, per_worker[index]))
+        for index in range(args.concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    samples = [sample for worker_samples in per_worker for sample in worker_samples]
+    by_route = {}
+    for sample in samples:
+        by_route.setdefault(sample[0], []).append(sample)
+    
+    result = {
+        'meta': {
+            'started_at': started_at,
+            'git_revision': git_revision(),
+            'python': platform.python_version(),
+            'duration_s': args.duration,
+            'warmup_s': args.warmup,
+            'concurrency': args.concurrency,
+            'users': args.users,
+            'seed': args.seed,
+            'targets': {'ordenes': args.ordenes_url, 'facturacion': args.facturacion_url},
+            'mix': {name: weight for name, (weight, _) in routes.items()}
+        },
+        'total': summarize(samples, args.duration),
+        'routes': {name: summarize(by_route[name], args.duration) for name in sorted(by_route)}
+    }
+    
+    if result['total']['rate_limited']:
+        print(f"Aviso: {result['total']['rate_limited']} respuestas 429; las rutas afectadas miden el límite "
+              'por usuario y no la capacidad (ver RATE_LIMIT_* en la ayuda del módulo)', file=sys.stderr)
+    
+    output = json.dumps(result, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output + '\n')
+    else:
+        print(output)
+
+def compare(args):
+    """Diferencias relativas de throughput y percentiles entre dos resultados de run"""
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    with open(args.candidate) as file:
+        candidate = json.load(file)
+    
+    def delta(before, after):
+        if before in (None, 0) or after is None:
+            return None
+        return round((after - before) / before * 100, 2)
+    
+    comparison = {}
+    for name in sorted(set(baseline['routes']) | set(candidate['routes'])):
+        before, after = baseline['routes'].get(name), candidate['routes'].get(name)
+        if not before or not after:
+            comparison[name] = {'baseline': before, 'candidate': after}
+            continue
+        comparison[name] = {
+            'throughput_rps_pct': delta(before['throughput_rps'], after['throughput_rps']),
+            **{f'{key}_ms_pct': delta(before['latency_ms'][key], after['latency_ms'][key]) for key in ['p50', 'p95', 'p99']}
+        }
+    
+    print(json.dumps({
+        'baseline': baseline['meta'].get('git_revision'),
+        'candidate': candidate['meta'].get('git_revision'),
+        'routes': comparison
+    }, indent=2, ensure_ascii=False))
+
+# ==================== MAIN ====================
+
+def main():
+    parser = argparse.ArgumentParser(description='Banco de pruebas de carga de órdenes y facturación')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    
+    seed_parser = subparsers.add_parser('seed', help='Poblar MongoDB con datos de prueba')
+    seed_parser.add_argument('--mongo-uri', default=MONGO_URI)
+    seed_parser.add_argument('--orders-db', default=ORDERS_DB_NAME)
+    seed_parser.add_argument('--billing-db', default=BILLING_DB_NAME)
+    seed_parser.add_argument('--workorders', type=int, default=100000, help='Órdenes de trabajo a generar')
+    seed_parser.add_argument('--invoices', type=int, default=100000, help='Facturas a generar')
+    seed_parser.add_argument('--clients', type=int, default=5000, help='Cantidad de clientes distintos')
+    seed_parser.add_argument('--technicians', type=int, default=200, help='Cantidad de técnicos distintos')
+    seed_parser.add_argument('--batch-size', type=int, default=5000)
+    seed_parser.add_argument('--seed', type=int, default=42)
+    seed_parser.add_argument('--drop', action='store_true', help='Vaciar las colecciones (incluidos los archivos) antes de poblar')
+    seed_parser.set_defaults(handler=seed)
+    
+    run_parser = subparsers.add_parser('run', help='Ejecutar la mezcla de peticiones')
+    run_parser.add_argument('--ordenes-url', default=ORDENES_URL)
+    run_parser.add_argument('--facturacion-url', default=FACTURACION_URL)
+    run_parser.add_argument('--jwt-secret', default=JWT_SECRET)
+    run_parser.add_argument('--duration', type=float, default=30, help='Segundos de medición')
+    run_parser.add_argument('--warmup', type=float, default=5, help='Segundos de calentamiento no medidos')
+    run_parser.add_argument('--concurrency', type=int, default=16, help='Workers concurrentes')
+    run_parser.add_argument('--users', type=int, default=10, help='Usuarios distintos (un token por usuario)')
+    run_parser.add_argument('--mix', default='{}', help='JSON (o @archivo) con pesos por patrón de ruta, p. ej. {"ordenes.*": 0}')
+    run_parser.add_argument('--clients', type=int, default=5000)
+    run_parser.add_argument('--technicians', type=int, default=200)
+    run_parser.add_argument('--sample-size', type=int, default=1000, help='Documentos existentes muestreados para ids y filtros')
+    run_parser.add_argument('--timeout', type=float, default=30)
+    run_parser.add_argument('--seed', type=int, default=42)
+    run_parser.add_argument('--output', help='Archivo JSON de resultados (por defecto stdout)')
+    run_parser.set_defaults(handler=run)
+    
+    compare_parser = subparsers.add_parser('compare', help='Comparar dos resultados de run')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('candidate')
+    compare_parser.set_defaults(handler=compare)
+    
+    args = parser.parse_args()
+    args.handler(args)
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,45 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, g
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
-from pymongo import MongoClient
-from datetime import datetime
+from pymongo import MongoClient, ReturnDocument, UpdateOne, ReplaceOne, monitoring, common, read_preferences
+from pymongo.errors import BulkWriteError, PyMongoError
+from datetime import datetime, timedelta, timezone
 import jwt
 import requests
 import os
 from dotenv import load_dotenv
 from bson.objectid import ObjectId
+from bson import json_util
+import base64
+import re
+import functools
+import gzip
+import csv
+import io
+import itertools
+import json
+import click
+import hashlib
+import threading
+import time
+import cProfile
+import pstats
+import random
+import hmac
+import math
+import contextlib
+from collections import OrderedDict, deque
+from prometheus_client import Counter, Gauge, Histogram, CollectorRegistry, generate_latest, multiprocess, CONTENT_TYPE_LATEST
+
+try:
+    import orjson
+except ImportError:  # sin orjson se usa el codificador json estándar
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # sin brotli solo se ofrece gzip
+    brotli = None
 
 load_dotenv()
 
@@ -18,16 +51,781 @@ MONGO_URI = os.getenv('MONGO_URI', 'mongodb://localhost:27017/')
 MONGO_DB_NAME = os.getenv('MONGO_DB_NAME', 'billing_db')
 JWT_SECRET = os.getenv('JWT_SECRET', 'secret')
 AUTH_SERVICE_URL = os.getenv('AUTH_SERVICE_URL', 'http://localhost:8001')
+BULK_CHUNK_SIZE = int(os.getenv('BULK_CHUNK_SIZE', 1000))
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', 1000))
+TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', 1024))
+TOKEN_CACHE_TTL = int(os.getenv('TOKEN_CACHE_TTL', 300))
+READ_CACHE_SIZE = int(os.getenv('READ_CACHE_SIZE', 0))  # por proceso: la invalidación no llega a otros workers (ver read_cache)
+READ_CACHE_TTL = float(os.getenv('READ_CACHE_TTL', 5))
+COUNT_CACHE_SIZE = int(os.getenv('COUNT_CACHE_SIZE', 1024))  # 0 desactiva el caché de conteos
+COUNT_CACHE_TTL = float(os.getenv('COUNT_CACHE_TTL', 10))
+JSON_ENCODER = os.getenv('JSON_ENCODER', 'orjson' if orjson else 'std')  # orjson, std
+SSE_HISTORY_SIZE = int(os.getenv('SSE_HISTORY_SIZE', 1000))
+SSE_HEARTBEAT = float(os.getenv('SSE_HEARTBEAT', 15))
+SSE_MAX_CONNECTIONS = int(os.getenv('SSE_MAX_CONNECTIONS', 4))  # suscriptores SSE por proceso, 0 sin límite
+CHANGE_FEED_SOURCE = os.getenv('CHANGE_FEED_SOURCE', 'local')  # local, changestream
+PROFILE_ENABLED = os.getenv('PROFILE_ENABLED', 'false').lower() == 'true'
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0))
+PROFILE_TOKEN = os.getenv('PROFILE_TOKEN', '')
+PROFILE_DIR = os.getenv('PROFILE_DIR', '/tmp/profiles-facturacion')
+PROFILE_KEEP = int(os.getenv('PROFILE_KEEP', 20))
+INDEX_BOOTSTRAP = os.getenv('INDEX_BOOTSTRAP', 'background')  # background, off
+RATE_LIMIT_READ = os.getenv('RATE_LIMIT_READ', '100:200')  # tokens por segundo:ráfaga por usuario, 0 desactiva
+RATE_LIMIT_WRITE = os.getenv('RATE_LIMIT_WRITE', '20:50')
+RATE_LIMIT_BULK = os.getenv('RATE_LIMIT_BULK', '1:5')
+RATE_LIMIT_MAX_KEYS = int(os.getenv('RATE_LIMIT_MAX_KEYS', 10000))
+# Peticiones que el proceso ejecuta a la vez (hilos bajo gunicorn, tareas del event loop
+# bajo hypercorn); no acota las conexiones que esperan en el servidor. Con gunicorn
+# gunicorn.conf.py lo deriva de los hilos del worker. 0 desactiva el límite global
+MAX_IN_FLIGHT = int(os.getenv('MAX_IN_FLIGHT', 64))
+ADMISSION_QUEUE_SIZE = int(os.getenv('ADMISSION_QUEUE_SIZE', 32))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv('ADMISSION_QUEUE_TIMEOUT', 0.1))
+MAX_PER_PAGE = int(os.getenv('MAX_PER_PAGE', 100))
+BATCH_GET_MAX = int(os.getenv('BATCH_GET_MAX', 500))
+ARCHIVE_AFTER_DAYS = float(os.getenv('ARCHIVE_AFTER_DAYS', 90))
+ARCHIVE_BATCH_SIZE = int(os.getenv('ARCHIVE_BATCH_SIZE', 1000))
+COMPRESSION_LEVEL = int(os.getenv('COMPRESSION_LEVEL', 6))  # gzip 1-9, 0 desactiva la compresión
+BROTLI_QUALITY = int(os.getenv('BROTLI_QUALITY', 4))  # 0-11
+COMPRESSION_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', 1024))  # bytes
+READ_PREFERENCE = os.getenv('READ_PREFERENCE', 'primary')  # primary, primaryPreferred, secondary, secondaryPreferred, nearest
+READ_MAX_STALENESS = int(os.getenv('READ_MAX_STALENESS', 90))  # segundos (mínimo 90), -1 sin límite
+
+# ==================== MÉTRICAS ====================
+
+# Buckets de latencia (segundos) para respuestas del orden de milisegundos
+LATENCY_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+http_request_duration = Histogram(
+    'http_request_duration_seconds',
+    'Latencia de las peticiones HTTP por ruta y código de estado',
+    ['method', 'route', 'status'],
+    buckets=LATENCY_BUCKETS
+)
+mongo_command_duration = Histogram(
+    'mongodb_command_duration_seconds',
+    'Duración de los comandos de MongoDB por colección y comando',
+    ['collection', 'command', 'outcome'],
+    buckets=LATENCY_BUCKETS
+)
+# Con varios workers (PROMETHEUS_MULTIPROC_DIR) los indicadores se suman entre procesos vivos
+mongo_pool_connections = Gauge(
+    'mongodb_pool_connections', 'Conexiones abiertas en el pool de MongoDB', ['address'],
+    multiprocess_mode='livesum'
+)
+mongo_pool_checked_out = Gauge(
+    'mongodb_pool_checked_out_connections', 'Conexiones del pool en uso', ['address'],
+    multiprocess_mode='livesum'
+)
+mongo_pool_max_size = Gauge(
+    'mongodb_pool_max_size', 'Tamaño máximo del pool de MongoDB', ['address'],
+    multiprocess_mode='livesum'
+)
+mongo_pool_checkout_failures = Counter(
+    'mongodb_pool_checkout_failures',
+    'Fallos al obtener una conexión del pool de MongoDB',
+    ['address', 'reason']
+)
+
+admission_rejections = Counter(
+    'http_admission_rejections',
+    'Peticiones rechazadas por el control de admisión',
+    ['route_class', 'reason']
+)
+
+def _address(event):
+    """Etiqueta host:puerto del servidor de un evento del pool"""
+    host, port = event.address
+    return f'{host}:{port}'
+
+class CommandMetricsListener(monitoring.CommandListener):
+    """Registra la duración de cada comando de MongoDB por colección y comando"""
+    
+    def __init__(self):
+        self._collections = {}
+    
+    def started(self, event):
+        # El nombre de la colección viene como valor del comando (getMore lo trae en 'collection')
+        target = event.command.get(event.command_name)
+        collection = target if isinstance(target, str) else event.command.get('collection', '')
+        self._collections[(event.connection_id, event.request_id)] = collection
+    
+    def _observe(self, event, outcome):
+        collection = self._collections.pop((event.connection_id, event.request_id), '')
+        mongo_command_duration.labels(collection, event.command_name, outcome).observe(event.duration_micros / 1e6)
+        if PROFILE_ENABLED:
+            record_profile_mongo(event.duration_micros / 1e6)
+    
+    def succeeded(self, event):
+        self._observe(event, 'ok')
+    
+    def failed(self, event):
+        self._observe(event, 'error')
+
+class PoolMetricsListener(monitoring.ConnectionPoolListener):
+    """Mantiene los indicadores de conexiones abiertas y en uso del pool"""
+    
+    def connection_created(self, event):
+        mongo_pool_connections.labels(_address(event)).inc()
+    
+    def connection_closed(self, event):
+        mongo_pool_connections.labels(_address(event)).dec()
+    
+    def connection_checked_out(self, event):
+        mongo_pool_checked_out.labels(_address(event)).inc()
+    
+    def connection_checked_in(self, event):
+        mongo_pool_checked_out.labels(_address(event)).dec()
+    
+    def connection_check_out_failed(self, event):
+        mongo_pool_checkout_failures.labels(_address(event), event.reason).inc()
+    
+    def pool_created(self, event):
+        mongo_pool_max_size.labels(_address(event)).set(event.options.get('maxPoolSize', common.MAX_POOL_SIZE))
+    
+    def pool_ready(self, event):
+        pass
+    
+    def pool_cleared(self, event):
+        pass
+    
+    def pool_closed(self, event):
+        mongo_pool_max_size.labels(_address(event)).set(0)
+    
+    def connection_ready(self, event):
+        pass
+    
+    def connection_check_out_started(self, event):
+        pass
+
+def render_metrics():
+    """Exposición de Prometheus; con varios workers (PROMETHEUS_MULTIPROC_DIR) agrega todos los procesos"""
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest()
+
+# Listeners compartidos por los clientes de MongoDB del proceso
+MONGO_LISTENERS = [CommandMetricsListener(), PoolMetricsListener()]
+
+@app.before_request
+def start_request_timer():
+    """Marca el inicio de la petición para medir su latencia"""
+    g.request_start = time.perf_counter()
 
-# Conexión a MongoDB
-client = MongoClient(MONGO_URI)
+@app.after_request
+def record_request_metrics(response):
+    """Registra la latencia por plantilla de ruta (no por URL, para acotar las etiquetas)"""
+    start = g.get('request_start')
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule else 'sin_ruta'
+        http_request_duration.labels(request.method, route, response.status_code).observe(time.perf_counter() - start)
+    return response
+
+# Modos de READ_PREFERENCE para las lecturas enrutadas
+READ_PREFERENCE_MODES = {
+    'primary': read_preferences.Primary,
+    'primaryPreferred': read_preferences.PrimaryPreferred,
+    'secondary': read_preferences.Secondary,
+    'secondaryPreferred': read_preferences.SecondaryPreferred,
+    'nearest': read_preferences.Nearest
+}
+
+def build_read_preference(mode, max_staleness):
+    """Preferencia de lectura de listados, búsqueda, exportación y reportes.
+    
+    max_staleness descarta los secundarios más atrasados que ese número de segundos;
+    no aplica al modo primary.
+    """
+    if mode not in READ_PREFERENCE_MODES:
+        raise ValueError(f"READ_PREFERENCE inválida. Debe ser: {', '.join(READ_PREFERENCE_MODES)}")
+    if mode == 'primary':
+        return read_preferences.Primary()
+    return READ_PREFERENCE_MODES[mode](max_staleness=max_staleness)
+
+# Conexión a MongoDB. Con connect=False no se abre ninguna conexión ni hilo de
+# monitoreo hasta la primera operación, de modo que cada worker pre-forkeado
+# crea su propio pool al atender su primera petición
+client = MongoClient(MONGO_URI, connect=False, tz_aware=True, event_listeners=MONGO_LISTENERS)
 db = client[MONGO_DB_NAME]
 invoices_collection = db['invoices']
+rollups_collection = db['invoice_rollups']
+# Registros en estado final movidos por archive-records; solo se consultan con include_archived=true
+invoices_archive_collection = db['invoices_archive']
+ARCHIVE_COLLECTION_NAME = invoices_archive_collection.name
+
+# Lecturas enrutadas según READ_PREFERENCE (p. ej. a los secundarios del replica set).
+# Las escrituras y las lecturas de un documento por _id siguen en el primario
+ROUTED_READ_PREFERENCE = build_read_preference(READ_PREFERENCE, READ_MAX_STALENESS)
+invoices_reads = invoices_collection.with_options(read_preference=ROUTED_READ_PREFERENCE)
+invoices_archive_reads = invoices_archive_collection.with_options(read_preference=ROUTED_READ_PREFERENCE)
+rollups_reads = rollups_collection.with_options(read_preference=ROUTED_READ_PREFERENCE)
+
+# Plan de índices: primero los campos de igualdad que acepta el listado y luego
+# la clave de orden (fecha_creacion, _id), para que cada combinación de filtros
+# se resuelva con un solo índice y sin ordenamiento en memoria
+INDEX_PLAN = [
+    [('numero_factura', 1)],
+    [('fecha_creacion', -1), ('_id', -1)],
+    [('estado', 1), ('fecha_creacion', -1), ('_id', -1)],
+    [('cliente_id', 1), ('fecha_creacion', -1), ('_id', -1)],
+    [('cliente_id', 1), ('estado', 1), ('fecha_creacion', -1), ('_id', -1)]
+]
+
+# Dimensiones y montos de los acumulados de facturación (invoice_rollups)
+ROLLUP_KEYS = ['cliente_id', 'estado', 'mes']
+ROLLUP_AMOUNTS = ['subtotal', 'iva', 'total']
+
+# Campos de filtro por igualdad que acepta list_invoices
+FILTER_FIELDS = ['estado', 'cliente_id']
+
+# Índice de texto para la búsqueda libre (q=); MongoDB admite uno por colección
+TEXT_INDEX_NAME = 'busqueda_texto'
+TEXT_INDEX_WEIGHTS = {'cliente_nombre': 10, 'items.descripcion': 5, 'notas': 1}
+SEARCH_MAX_LENGTH = 200
+
+def ensure_indexes():
+    """Crea los índices declarados en INDEX_PLAN (idempotente), también en el archivo"""
+    for collection in (invoices_collection, invoices_archive_collection):
+        for keys in INDEX_PLAN:
+            collection.create_index(keys)
+        collection.create_index(
+            [(field, 'text') for field in TEXT_INDEX_WEIGHTS],
+            name=TEXT_INDEX_NAME,
+            weights=TEXT_INDEX_WEIGHTS,
+            default_language='spanish'
+        )
+    rollups_collection.create_index([(key, 1) for key in ROLLUP_KEYS], unique=True)
+
+_indexes_lock = threading.Lock()
+_indexes_started = False
+
+def bootstrap_indexes():
+    """Crea los índices y los acumulados faltantes registrando el error en lugar de propagarlo (se ejecuta en segundo plano)"""
+    try:
+        ensure_indexes()
+        ensure_rollups()
+    except PyMongoError as e:
+        app.logger.error(f'No se pudieron crear los índices: {e}')
+
+def start_index_bootstrap():
+    """Lanza la creación de índices en un hilo de fondo, una sola vez por proceso.
+    
+    Los índices no se crean al importar el módulo: bajo gunicorn los crea el primer
+    worker del despliegue (ver gunicorn.conf.py) y también pueden crearse como paso
+    de despliegue con el comando ensure-indexes.
+    """
+    global _indexes_started
+    if INDEX_BOOTSTRAP != 'background':
+        return
+    
+    with _indexes_lock:
+        if not _indexes_started:
+            threading.Thread(target=bootstrap_indexes, name='index-bootstrap', daemon=True).start()
+            _indexes_started = True
+
+# ==================== SERIALIZACIÓN JSON ====================
+
+def _json_default(value):
+    """Serializa los tipos de BSON que JSON no soporta directamente"""
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f'Tipo no serializable: {type(value).__name__}')
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Proveedor JSON que serializa ObjectId y datetime sin pre-procesar los documentos.
+    
+    Con JSON_ENCODER=orjson (por defecto si está instalado) la respuesta se genera
+    directamente en bytes con orjson; con JSON_ENCODER=std se usa el módulo json.
+    """
+    
+    def dumps(self, obj, **kwargs):
+        if JSON_ENCODER == 'orjson':
+            return orjson.dumps(obj, default=_json_default).decode()
+        kwargs.setdefault('default', _json_default)
+        return super().dumps(obj, **kwargs)
+    
+    def response(self, *args, **kwargs):
+        if JSON_ENCODER != 'orjson':
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=_json_default, option=orjson.OPT_APPEND_NEWLINE)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+app.json = FastJSONProvider(app)
+
+# Nombres de campo válidos para fields= (incluye subcampos con punto)
+FIELD_NAME = re.compile(r'[A-Za-z_][A-Za-z0-9_]*(\.[A-Za-z0-9_]+)*')
+
+def parse_fields(fields):
+    """Convierte fields=a,b,c en una proyección de Mongo. Retorna (proyeccion, error)"""
+    if not fields:
+        return None, None
+    
+    projection = {}
+    for field in fields.split(','):
+        field = field.strip()
+        if not FIELD_NAME.fullmatch(field):
+            return None, f'Campo inválido en fields: {field}'
+        projection[field] = 1
+    
+    return projection, None
+
+# ==================== FECHAS ====================
+
+# Campos de fecha, guardados como fechas BSON en UTC
+DATE_FIELDS = ['fecha_creacion', 'fecha_actualizacion', 'fecha_pago']
+
+def utcnow():
+    """Instante actual en UTC"""
+    return datetime.now(timezone.utc)
+
+def parse_datetime(value):
+    """Convierte un texto ISO 8601 en fecha UTC; sin zona horaria se asume UTC. Lanza ValueError si no es válido"""
+    if not isinstance(value, str):
+        raise ValueError(value)
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        return parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc)
+
+def parse_date_fields(data, fields):
+    """Convierte en fechas UTC los campos de fecha recibidos en data. Retorna el mensaje de error o None"""
+    for field in fields:
+        if data.get(field) is not None:
+            try:
+                data[field] = parse_datetime(data[field])
+            except ValueError:
+                return f'{field} debe ser una fecha ISO 8601'
+    return None
+
+def parse_date_range(args):
+    """Rango [desde, hasta) sobre fecha_creacion a partir de los parámetros del listado. Retorna (filtro, error)"""
+    date_range = {}
+    for param, operator in (('desde', '$gte'), ('hasta', '$lt')):
+        value = args.get(param)
+        if value:
+            try:
+                date_range[operator] = parse_datetime(value)
+            except ValueError:
+                return None, f'{param} debe ser una fecha ISO 8601, p. ej. 2024-05-01'
+    return date_range, None
+
+# ==================== COMPRESIÓN DE RESPUESTAS ====================
+
+# Codificaciones ofrecidas, en orden de preferencia ante igual calidad en Accept-Encoding
+COMPRESSION_ENCODINGS = ['br', 'gzip'] if brotli else ['gzip']
+COMPRESSIBLE_MIMETYPES = ('application/json',)
+
+def compress_body(data, encoding):
+    """Comprime el cuerpo con la codificación negociada"""
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=COMPRESSION_LEVEL, mtime=0)
+
+def compressible(response):
+    """Indica si la respuesta es JSON y todavía no está comprimida"""
+    return (
+        COMPRESSION_LEVEL > 0
+        and response.mimetype in COMPRESSIBLE_MIMETYPES
+        and 'Content-Encoding' not in response.headers
+    )
+
+def mark_compressed(response, encoding):
+    """Cabeceras de una respuesta comprimida; el ETag pasa a ser débil porque cambió la representación"""
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+
+@app.after_request
+def compress_response(response):
+    """Comprime las respuestas JSON según Accept-Encoding; las respuestas en streaming se envían tal cual"""
+    if response.direct_passthrough or response.is_streamed or not compressible(response):
+        return response
+    
+    response.vary.add('Accept-Encoding')
+    encoding = request.accept_encodings.best_match(COMPRESSION_ENCODINGS)
+    data = response.get_data()
+    if encoding is None or len(data) < COMPRESSION_MIN_SIZE:
+        return response
+    
+    response.set_data(compress_body(data, encoding))
+    mark_compressed(response, encoding)
+    return response
+
+# ==================== CACHÉS EN PROCESO ====================
+
+class LRUCache:
+    """Caché LRU acotado, con expiración por entrada y seguro entre hilos"""
+    
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.generation = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key):
+        """Retorna el valor guardado o None si no existe o ya expiró"""
+        if self.max_size <= 0:
+            return None
+        
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.time():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+    
+    def put(self, key, value, expires_at=None, generation=None):
+        """Guarda un valor hasta TTL segundos, o hasta expires_at si es antes.
+        
+        Con generation, el valor se descarta si hubo una invalidación desde que se leyó
+        la generación: así una lectura lenta no vuelve a guardar un documento ya modificado.
+        """
+        if self.max_size <= 0:
+            return
+        
+        deadline = time.time() + self.ttl
+        if expires_at is not None:
+            deadline = min(deadline, expires_at)
+        
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._entries[key] = (deadline, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+    
+    def delete(self, key):
+        """Invalida una entrada y avanza la generación del caché"""
+        with self._lock:
+            self._entries.pop(key, None)
+            self.generation += 1
+    
+    def clear(self):
+        """Invalida todas las entradas y avanza la generación del caché"""
+        with self._lock:
+            self._entries.clear()
+            self.generation += 1
+    
+    def stats(self):
+        """Contadores de aciertos y fallos del caché"""
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+# Tokens JWT ya verificados, indexados por el hash SHA-256 del token. Cada entrada
+# expira a más tardar en el 'exp' del token
+token_cache = LRUCache(TOKEN_CACHE_SIZE, TOKEN_CACHE_TTL)
+
+# Lectura de documentos individuales (opcional, READ_CACHE_SIZE=0 lo desactiva).
+# Cada proceso tiene su propio caché y las escrituras (también archive-records)
+# solo invalidan el del proceso que las hizo: los demás workers de gunicorn pueden
+# responder 200 o 304 con la versión anterior durante hasta READ_CACHE_TTL
+# segundos, por eso el TTL debe ser corto
+read_cache = LRUCache(READ_CACHE_SIZE, READ_CACHE_TTL)
+
+# Totales de la paginación por offset, indexados por filtro normalizado. Cualquier
+# escritura lo vacía; entre procesos el TTL acota cuánto puede atrasarse un total
+count_cache = LRUCache(COUNT_CACHE_SIZE, COUNT_CACHE_TTL)
+
+def count_key(query, include_archived):
+    """Clave del caché de conteos: el filtro con claves ordenadas y la generación vigente.
+    
+    Un conteo que empezó antes de una invalidación queda guardado con la generación
+    anterior y ya no se vuelve a leer.
+    """
+    normalized = json.dumps(query, sort_keys=True, default=str)
+    return (count_cache.generation, include_archived, normalized)
+
+def document_etag(document):
+    """ETag fuerte derivado del _id y de la última modificación del documento"""
+    stamp = document.get('fecha_actualizacion') or document.get('fecha_creacion')
+    return hashlib.sha1(f"{document['_id']}:{stamp}".encode()).hexdigest()
+
+def not_modified(etag):
+    """Respuesta 304 para peticiones condicionales con If-None-Match"""
+    response = Response(status=304)
+    response.set_etag(etag)
+    return response
+
+# ==================== PERFILADO BAJO DEMANDA ====================
+
+# Cabecera que activa el perfilado de una petición; su valor debe ser PROFILE_TOKEN
+PROFILE_HEADER = 'X-Profile'
+
+# Perfil de la petición en curso, visible solo para el hilo que la atiende
+_profiling = threading.local()
+# Un solo perfil a la vez: acota el costo y evita perfiladores simultáneos
+_profile_lock = threading.Lock()
+
+def should_profile():
+    """Decide si perfilar la petición: cabecera privilegiada o muestreo aleatorio"""
+    token = request.headers.get(PROFILE_HEADER)
+    if token and PROFILE_TOKEN and hmac.compare_digest(token, PROFILE_TOKEN):
+        return True
+    return random.random() < PROFILE_SAMPLE_RATE
+
+def start_profile():
+    """Activa cProfile para la petición si corresponde y hay cupo"""
+    if not should_profile() or not _profile_lock.acquire(blocking=False):
+        return
+    _profiling.mongo = 0.0
+    _profiling.start = time.perf_counter()
+    _profiling.profiler = cProfile.Profile()
+    _profiling.profiler.enable()
+
+def record_profile_mongo(seconds):
+    """Suma la duración de un comando de Mongo al perfil en curso del hilo, si lo hay"""
+    if getattr(_profiling, 'profiler', None) is not None:
+        _profiling.mongo += seconds
+
+def profile_phases(stats, total, mongo):
+    """Desglosa el tiempo de la petición (ms) en autenticación, Mongo, serialización y resto del handler"""
+    auth = serialization = 0.0
+    for (filename, _, function), (_, _, _, cumulative, callers) in stats.stats.items():
+        if filename != __file__:
+            continue
+        if function == 'verify_token':
+            auth += cumulative
+        elif function == 'response':
+            serialization += cumulative
+        elif function == 'dumps':
+            # Lo que se llamó desde FastJSONProvider.response ya quedó contado
+            serialization += cumulative - sum(
+                edge[3] for (caller_file, _, caller), edge in callers.items()
+                if caller_file == __file__ and caller == 'response'
+            )
+    
+    phases = {'auth': auth, 'mongo': mongo, 'serialization': serialization}
+    phases['handler'] = max(0.0, total - sum(phases.values()))
+    phases['total'] = total
+    return {phase: round(seconds * 1000, 3) for phase, seconds in phases.items()}
+
+def write_profile(stats, metadata):
+    """Guarda el perfil (.prof, formato pstats) y su desglose (.json) en el anillo de la ruta"""
+    directory = os.path.join(PROFILE_DIR, re.sub(r'[^A-Za-z0-9]+', '_', metadata['route']).strip('_') or 'raiz')
+    os.makedirs(directory, exist_ok=True)
+    name = f"{datetime.now().strftime('%Y%m%dT%H%M%S%f')}-{metadata['method']}-{metadata['status']}"
+    stats.dump_stats(os.path.join(directory, f'{name}.prof'))
+    with open(os.path.join(directory, f'{name}.json'), 'w') as file:
+        json.dump(metadata, file)
+    
+    # Anillo acotado: se conservan los PROFILE_KEEP perfiles más recientes de la ruta
+    profiles = sorted(entry[:-len('.prof')] for entry in os.listdir(directory) if entry.endswith('.prof'))
+    for old in profiles[:-PROFILE_KEEP]:
+        for extension in ('.prof', '.json'):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(os.path.join(directory, old + extension))
+    
+    return name
+
+def finish_profile(response):
+    """Detiene el perfil, lo guarda y expone el desglose en la cabecera Server-Timing"""
+    profiler = getattr(_profiling, 'profiler', None)
+    if profiler is None:
+        return response
+    
+    profiler.disable()
+    total = time.perf_counter() - _profiling.start
+    stats = pstats.Stats(profiler)
+    route = request.url_rule.rule if request.url_rule else 'sin_ruta'
+    phases = profile_phases(stats, total, _profiling.mongo)
+    
+    response.headers['Server-Timing'] = ', '.join(f'{phase};dur={ms}' for phase, ms in phases.items())
+    try:
+        response.headers['X-Profile-Id'] = write_profile(stats, {
+            'route': route,
+            'method': request.method,
+            'path': request.full_path,
+            'status': response.status_code,
+            'phases_ms': phases
+        })
+    except OSError as e:
+        app.logger.warning(f'No se pudo guardar el perfil: {e}')
+    
+    release_profile()
+    return response
+
+def release_profile(error=None):
+    """Libera el perfil del hilo (también si la petición terminó con una excepción)"""
+    profiler = getattr(_profiling, 'profiler', None)
+    if profiler is not None:
+        profiler.disable()
+        _profiling.profiler = None
+        _profile_lock.release()
+
+# Deshabilitado no se registra ningún hook: el costo en la ruta crítica es nulo
+if PROFILE_ENABLED:
+    app.before_request(start_profile)
+    app.after_request(finish_profile)
+    app.teardown_request(release_profile)
 
-# Crear índices
-invoices_collection.create_index('numero_factura')
-invoices_collection.create_index('cliente_id')
-invoices_collection.create_index('fecha_creacion')
+# ==================== CONTROL DE ADMISIÓN ====================
+
+# Clase de cada ruta para los límites por usuario; las que no aparecen se
+# clasifican por método (GET es lectura, el resto escritura)
+ROUTE_CLASSES = {
+    'bulk_create_invoices': 'bulk',
+    'export_invoices': 'bulk',
+    'batch_get_invoices': 'read'
+}
+
+# Rutas de larga duración: no ocupan lugar en el límite global de concurrencia sino
+# en uno propio, para que los suscriptores SSE no acaparen los hilos del worker
+LONG_LIVED_ROUTES = {'invoice_events'}
+
+# Segundos sugeridos al cliente cuando el servicio está saturado
+ADMISSION_RETRY_AFTER = 1
+
+def parse_rate_limit(spec):
+    """Convierte 'tasa:ráfaga' en (tokens por segundo, tokens acumulables)"""
+    rate, _, burst = (spec or '0').partition(':')
+    rate = float(rate)
+    return rate, float(burst) if burst else max(rate, 1)
+
+class TokenBucketLimiter:
+    """Token bucket por clave, acotado a las claves usadas más recientemente"""
+    
+    def __init__(self, rate, burst, max_keys=RATE_LIMIT_MAX_KEYS):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def acquire(self, key):
+        """Consume un token de la clave. Retorna 0 si se admite o los segundos hasta el próximo token"""
+        if self.rate <= 0:
+            return 0
+        
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            wait = 0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / self.rate
+            
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        
+        return wait
+
+class ConcurrencyLimiter:
+    """Límite de peticiones en curso del proceso, con una cola de espera corta y acotada"""
+    
+    def __init__(self, limit, queue_size, timeout):
+        self.limit = limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.in_flight = 0
+        self.waiting = 0
+        self._condition = threading.Condition()
+    
+    def acquire(self):
+        """Ocupa un lugar. Retorna False si la cola está llena o se agotó la espera"""
+        if self.limit <= 0:
+            return True
+        
+        with self._condition:
+            if self.in_flight >= self.limit:
+                if self.waiting >= self.queue_size:
+                    return False
+                
+                self.waiting += 1
+                try:
+                    admitted = self._condition.wait_for(lambda: self.in_flight < self.limit, self.timeout)
+                finally:
+                    self.waiting -= 1
+                if not admitted:
+                    return False
+            
+            self.in_flight += 1
+            return True
+    
+    def release(self):
+        """Libera un lugar y despierta a la siguiente petición en espera"""
+        if self.limit <= 0:
+            return
+        
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify()
+
+class AdmissionSlot:
+    """Lugar ocupado por una petición en un limitador; liberarlo más de una vez no tiene efecto"""
+    
+    def __init__(self, limiter):
+        self.limiter = limiter
+        # True cuando lo libera el cierre de una respuesta en streaming y no el fin de la petición
+        self.deferred = False
+        self._released = False
+        self._lock = threading.Lock()
+    
+    def release(self):
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        self.limiter.release()
+
+# Un limitador por clase de ruta. Los contadores son por proceso: con varios
+# workers el límite efectivo por usuario se multiplica por la cantidad de workers
+rate_limiters = {
+    'read': TokenBucketLimiter(*parse_rate_limit(RATE_LIMIT_READ)),
+    'write': TokenBucketLimiter(*parse_rate_limit(RATE_LIMIT_WRITE)),
+    'bulk': TokenBucketLimiter(*parse_rate_limit(RATE_LIMIT_BULK))
+}
+concurrency_limiter = ConcurrencyLimiter(MAX_IN_FLIGHT, ADMISSION_QUEUE_SIZE, ADMISSION_QUEUE_TIMEOUT)
+stream_limiter = ConcurrencyLimiter(SSE_MAX_CONNECTIONS, 0, 0)
+
+def route_class(endpoint, method):
+    """Clase de límite (read, write o bulk) de una ruta"""
+    return ROUTE_CLASSES.get(endpoint) or ('read' if method in ('GET', 'HEAD') else 'write')
+
+def rate_limit_retry_after(user_key, kind):
+    """Consume un token del usuario. Retorna el valor de Retry-After si excedió su límite, o None"""
+    wait = rate_limiters[kind].acquire(str(user_key))
+    if not wait:
+        return None
+    
+    admission_rejections.labels(kind, 'rate_limit').inc()
+    return str(math.ceil(wait))
+
+def rate_limited(retry_after):
+    """Respuesta 429 para un usuario que excedió su límite"""
+    return jsonify({
+        'success': False,
+        'message': 'Límite de peticiones excedido, intente más tarde'
+    }), 429, {'Retry-After': retry_after}
+
+def overloaded(kind):
+    """Respuesta 503 cuando el servicio no admite más peticiones en curso"""
+    admission_rejections.labels(kind, 'overload').inc()
+    return jsonify({
+        'success': False,
+        'message': 'Servicio saturado, intente más tarde'
+    }), 503, {'Retry-After': str(ADMISSION_RETRY_AFTER)}
 
 # Middleware para validar JWT
 def verify_token(token):
@@ -40,7 +838,14 @@ def verify_token(token):
         if token.startswith('Bearer '):
             token = token[7:]
         
+        key = hashlib.sha256(token.encode()).digest()
+        decoded = token_cache.get(key)
+        if decoded is not None:
+            return decoded, None
+        
         decoded = jwt.decode(token, JWT_SECRET, algorithms=['HS256'])
+        expires_at = decoded.get('exp') if isinstance(decoded.get('exp'), (int, float)) else None
+        token_cache.put(key, decoded, expires_at)
         return decoded, None
     except jwt.ExpiredSignatureError:
         return None, 'Token expirado'
@@ -48,7 +853,7 @@ def verify_token(token):
         return None, 'Token inválido'
 
 def require_auth(f):
-    """Decorador para rutas protegidas"""
+    """Decorador para rutas protegidas; aplica también el control de admisión"""
     def decorated_function(*args, **kwargs):
         auth_header = request.headers.get('Authorization')
         if not auth_header:
@@ -59,11 +864,863 @@ def require_auth(f):
             return jsonify({'success': False, 'message': error}), 401
         
         request.user = decoded
-        return f(*args, **kwargs)
+        
+        kind = route_class(request.endpoint, request.method)
+        retry_after = rate_limit_retry_after(decoded.get('id') or request.remote_addr, kind)
+        if retry_after:
+            return rate_limited(retry_after)
+        
+        limiter = stream_limiter if request.endpoint in LONG_LIVED_ROUTES else concurrency_limiter
+        if not limiter.acquire():
+            return overloaded(kind)
+        g.admission_slot = slot = AdmissionSlot(limiter)
+        
+        # Una respuesta en streaming sigue ocupando el lugar hasta que se cierra;
+        # las demás lo liberan en release_admission al terminar la petición
+        response = app.make_response(f(*args, **kwargs))
+        if response.is_streamed:
+            slot.deferred = True
+            response.call_on_close(slot.release)
+        return response
     
     decorated_function.__name__ = f.__name__
     return decorated_function
 
+@app.teardown_request
+def release_admission(exc):
+    """Libera el lugar de admisión de la petición, también si un hook posterior falló"""
+    slot = g.pop('admission_slot', None)
+    # Con una excepción la respuesta en streaming se descarta y su cierre nunca llega
+    if slot is not None and (exc is not None or not slot.deferred):
+        slot.release()
+
+# ==================== SESIONES CAUSALES ====================
+
+# Las respuestas llevan la posición causal de la petición; el cliente la reenvía para
+# que sus lecturas siguientes (aunque vayan a un secundario) vean sus escrituras
+CAUSAL_TOKEN_HEADER = 'X-Causal-Token'
+
+def _sign(payload):
+    """Firma HMAC-SHA256 de un token con el secreto del servicio"""
+    return hmac.new(JWT_SECRET.encode(), payload.encode(), hashlib.sha256).hexdigest()
+
+def encode_causal_token(session):
+    """Token firmado con el operationTime y el $clusterTime de la sesión"""
+    payload = base64.urlsafe_b64encode(json_util.dumps({
+        'operationTime': session.operation_time,
+        'clusterTime': session.cluster_time
+    }).encode()).decode()
+    return f'{payload}.{_sign(payload)}'
+
+def decode_causal_token(token):
+    """Retorna (operationTime, $clusterTime) o None si el token es inválido o fue alterado"""
+    payload, _, signature = (token or '').partition('.')
+    if not payload or not hmac.compare_digest(signature, _sign(payload)):
+        return None
+    try:
+        data = json_util.loads(base64.urlsafe_b64decode(payload.encode()).decode())
+        return data['operationTime'], data['clusterTime']
+    except (ValueError, TypeError, KeyError):
+        return None
+
+def advance_session(session, token):
+    """Adelanta la sesión a la posición del token; uno inválido se ignora"""
+    position = decode_causal_token(token)
+    if position is None:
+        return
+    operation_time, cluster_time = position
+    if cluster_time:
+        session.advance_cluster_time(cluster_time)
+    if operation_time:
+        session.advance_operation_time(operation_time)
+
+def db_session():
+    """Sesión causal de la petición en curso, adelantada al X-Causal-Token recibido"""
+    if 'db_session' not in g:
+        g.db_session = client.start_session(causal_consistency=True)
+        advance_session(g.db_session, request.headers.get(CAUSAL_TOKEN_HEADER))
+    return g.db_session
+
+@app.after_request
+def attach_causal_token(response):
+    """Agrega el X-Causal-Token si la petición usó la sesión causal"""
+    session = g.get('db_session')
+    if session is not None and session.operation_time is not None:
+        response.headers[CAUSAL_TOKEN_HEADER] = encode_causal_token(session)
+    return response
+
+@app.teardown_request
+def end_db_session(exc):
+    """Libera la sesión causal al terminar la petición"""
+    session = g.pop('db_session', None)
+    if session is not None:
+        session.end_session()
+
+# ==================== PAGINACIÓN POR CURSOR ====================
+
+# Orden estable para la paginación por cursor (más recientes primero)
+CURSOR_SORT = [('fecha_creacion', -1), ('_id', -1)]
+
+def encode_cursor(document, sort_field='fecha_creacion'):
+    """Genera un cursor opaco a partir de la clave de orden del documento"""
+    payload = json_util.dumps({
+        sort_field: document.get(sort_field),
+        '_id': document['_id']
+    })
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+def decode_cursor(cursor, sort_field='fecha_creacion'):
+    """Decodifica un cursor opaco. Retorna (valor de sort_field, _id) o None si es inválido"""
+    try:
+        payload = json_util.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+        if not isinstance(payload.get('_id'), ObjectId) or sort_field not in payload:
+            return None
+        return payload[sort_field], payload['_id']
+    except (ValueError, TypeError, AttributeError):
+        return None
+
+def apply_cursor(query, value, last_id, sort_field='fecha_creacion'):
+    """Agrega al filtro el predicado de rango que continúa después del cursor"""
+    after = {'$or': [
+        {sort_field: {'$lt': value}},
+        {sort_field: value, '_id': {'$lt': last_id}}
+    ]}
+    return {'$and': [query, after]} if query else after
+
+def build_search_pipeline(query, projection=None, position=None, skip=0, limit=10):
+    """Pipeline de búsqueda por texto ordenado por relevancia (textScore) y _id.
+    
+    El query debe incluir $text: va en la primera etapa para usar el índice de
+    texto, y la continuación por cursor se aplica sobre la relevancia calculada.
+    """
+    pipeline = [
+        {'$match': query},
+        {'$addFields': {'relevancia': {'$meta': 'textScore'}}}
+    ]
+    if position:
+        pipeline.append({'$match': apply_cursor({}, *position, sort_field='relevancia')})
+    pipeline.append({'$sort': {'relevancia': -1, '_id': -1}})
+    if skip:
+        pipeline.append({'$skip': skip})
+    pipeline.append({'$limit': limit})
+    if projection:
+        pipeline.append({'$project': {**projection, 'relevancia': 1}})
+    return pipeline
+
+# ==================== DIAGNÓSTICO DE ÍNDICES ====================
+
+def _plan_stages(plan):
+    """Recorre un plan de explain() y retorna sus etapas e índices utilizados"""
+    stages, indexes = [], []
+    pending = [plan]
+    while pending:
+        node = pending.pop()
+        if isinstance(node, list):
+            pending.extend(node)
+        elif isinstance(node, dict):
+            if 'stage' in node:
+                stages.append(node['stage'])
+            if 'indexName' in node:
+                indexes.append(node['indexName'])
+            pending.extend(value for value in node.values() if isinstance(value, (dict, list)))
+    return stages, indexes
+
+def _sample_value(field):
+    """Obtiene un valor real del campo para que el explain refleje datos existentes"""
+    document = invoices_collection.find_one({field: {'$nin': [None, '']}}, {field: 1})
+    return document[field] if document else f'<{field}>'
+
+def build_index_report(limit=10):
+    """Ejecuta explain() sobre cada combinación de filtros soportada por el listado"""
+    samples = {field: _sample_value(field) for field in FILTER_FIELDS}
+    report = []
+    
+    for size in range(len(FILTER_FIELDS) + 1):
+        for fields in itertools.combinations(FILTER_FIELDS, size):
+            query = {field: samples[field] for field in fields}
+            explain = invoices_collection.find(query).sort(CURSOR_SORT).limit(limit).explain()
+            stages, indexes = _plan_stages(explain.get('queryPlanner', {}).get('winningPlan', {}))
+            stats = explain.get('executionStats', {})
+            report.append({
+                'filters': list(fields),
+                'indexes': indexes,
+                'stages': stages,
+                'docs_examined': stats.get('totalDocsExamined'),
+                'keys_examined': stats.get('totalKeysExamined'),
+                'n_returned': stats.get('nReturned'),
+                'execution_ms': stats.get('executionTimeMillis'),
+                'collscan': 'COLLSCAN' in stages,
+                'blocking_sort': 'SORT' in stages
+            })
+    
+    declared = {'_id_', TEXT_INDEX_NAME} | {'_'.join(f'{field}_{direction}' for field, direction in keys) for keys in INDEX_PLAN}
+    undeclared = [name for name in invoices_collection.index_information() if name not in declared]
+    
+    return {
+        'collection': invoices_collection.name,
+        'queries': report,
+        'undeclared_indexes': undeclared,
+        'collscans': sum(1 for entry in report if entry['collscan'])
+    }
+
+# ==================== FACTURAS ====================
+
+def validate_invoice(data):
+    """Valida los datos de una factura nueva. Retorna el mensaje de error o None"""
+    if not isinstance(data, dict):
+        return 'Se esperaba un objeto JSON'
+    
+    required_fields = ['numero_factura', 'cliente_id', 'cliente_nombre', 'items']
+    for field in required_fields:
+        if not data.get(field):
+            return f'Campo requerido: {field}'
+    
+    if not isinstance(data.get('items'), list) or len(data['items']) == 0:
+        return 'items debe ser una lista no vacía'
+    
+    for position, item in enumerate(data['items']):
+        if not isinstance(item, dict):
+            return f'items[{position}] debe ser un objeto'
+        for field in ['cantidad', 'precio_unitario']:
+            value = item.get(field, 0)
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+                return f'items[{position}].{field} debe ser un número no negativo'
+    
+    if data.get('fecha_pago') is not None:
+        try:
+            parse_datetime(data['fecha_pago'])
+        except ValueError:
+            return 'fecha_pago debe ser una fecha ISO 8601'
+    
+    return None
+
+def build_invoice(data, user_id):
+    """Construye el documento de una factura nueva calculando sus totales"""
+    # Cálcular totales
+    subtotal = 0
+    for item in data['items']:
+        subtotal += item.get('cantidad', 0) * item.get('precio_unitario', 0)
+    
+    iva = subtotal * 0.19  # IVA 19%
+    total = subtotal + iva
+    
+    return {
+        'numero_factura': data['numero_factura'],
+        'cliente_id': data['cliente_id'],
+        'cliente_nombre': data['cliente_nombre'],
+        'items': data['items'],
+        'subtotal': subtotal,
+        'iva': iva,
+        'total': total,
+        'estado': data.get('estado', 'pendiente'),  # pendiente, pagada, cancelada
+        'usuario_id': user_id,
+        'fecha_creacion': utcnow(),
+        'fecha_pago': parse_datetime(data['fecha_pago']) if data.get('fecha_pago') is not None else None,
+        'notas': data.get('notas', '')
+    }
+
+def build_list_query(args):
+    """Construye el filtro de Mongo a partir de los parámetros del listado"""
+    query = {}
+    for field in FILTER_FIELDS:
+        value = args.get(field)
+        if value:
+            query[field] = value
+    return query
+
+# ==================== ACUMULADOS DE FACTURACIÓN ====================
+
+def month_key(value):
+    """Mes AAAA-MM (UTC) de una fecha; admite los textos ISO anteriores a la migración"""
+    if isinstance(value, datetime):
+        return value.astimezone(timezone.utc).strftime('%Y-%m')
+    return str(value or '')[:7]
+
+def rollup_key(invoice):
+    """Grupo (cliente_id, estado, mes) al que pertenece una factura"""
+    return (invoice.get('cliente_id'), invoice.get('estado'), month_key(invoice.get('fecha_creacion')))
+
+def rollup_updates(changes):
+    """Convierte cambios (factura, signo) en operaciones $inc sobre invoice_rollups.
+    
+    Los cambios que se cancelan dentro de un mismo grupo no generan operación.
+    """
+    deltas = {}
+    for invoice, sign in changes:
+        delta = deltas.setdefault(rollup_key(invoice), dict.fromkeys(['cantidad'] + ROLLUP_AMOUNTS, 0))
+        delta['cantidad'] += sign
+        for field in ROLLUP_AMOUNTS:
+            delta[field] += sign * (invoice.get(field) or 0)
+    
+    return [
+        UpdateOne(dict(zip(ROLLUP_KEYS, key)), {'$inc': delta}, upsert=True)
+        for key, delta in deltas.items() if any(delta.values())
+    ]
+
+def apply_rollups(changes, session=None):
+    """Aplica de forma incremental los cambios de facturas sobre los acumulados"""
+    operations = rollup_updates(changes)
+    if operations:
+        rollups_collection.bulk_write(operations, ordered=False, session=session)
+
+def invoices_inserted(invoices, session=None):
+    """Registra un bloque de facturas recién insertadas en acumulados y feed de cambios"""
+    apply_rollups(((invoice, 1) for invoice in invoices), session=session)
+    for invoice in invoices:
+        publish_event('create', invoice)
+
+# Campos de la factura de los que dependen los acumulados (mes sale de fecha_creacion)
+ROLLUP_FIELDS = ['cliente_id', 'estado', 'fecha_creacion'] + ROLLUP_AMOUNTS
+
+def rollup_guard(previous):
+    """Filtro que exige que los campos de los acumulados sigan como en previous"""
+    return {'_id': previous['_id'], **{field: previous.get(field) for field in ROLLUP_FIELDS}}
+
+def update_invoice_tracked(invoice_id, update, session=None):
+    """Aplica update a la factura y ajusta los acumulados. Retorna la factura resultante o None.
+    
+    De la versión previa solo se leen los campos de los acumulados y la actualización
+    exige que sigan iguales: si otra escritura los cambió entre medio se reintenta.
+    """
+    while True:
+        previous = invoices_collection.find_one({'_id': invoice_id}, ROLLUP_FIELDS, session=session)
+        if previous is None:
+            return None
+        
+        invoice = invoices_collection.find_one_and_update(
+            rollup_guard(previous),
+            update,
+            return_document=ReturnDocument.AFTER,
+            session=session
+        )
+        if invoice is not None:
+            apply_rollups([(previous, -1), (invoice, 1)], session=session)
+            return invoice
+
+def rollup_rebuild_pipeline():
+    """Pipeline que recalcula invoice_rollups sobre las facturas activas y archivadas"""
+    return [
+        # Los archivados siguen contando en los totales históricos
+        {'$unionWith': {'coll': ARCHIVE_COLLECTION_NAME}},
+        {'$group': {
+            '_id': {
+                'cliente_id': '$cliente_id',
+                'estado': '$estado',
+                'mes': {'$cond': [
+                    {'$eq': [{'$type': '$fecha_creacion'}, 'date']},
+                    {'$dateToString': {'format': '%Y-%m', 'date': '$fecha_creacion'}},
+                    {'$substrCP': [{'$ifNull': ['$fecha_creacion', '']}, 0, 7]}
+                ]}
+            },
+            'cantidad': {'$sum': 1},
+            **{field: {'$sum': f'${field}'} for field in ROLLUP_AMOUNTS}
+        }},
+        {'$project': {
+            '_id': 0,
+            **{key: f'$_id.{key}' for key in ROLLUP_KEYS},
+            'cantidad': 1,
+            **{field: 1 for field in ROLLUP_AMOUNTS}
+        }},
+        {'$out': rollups_collection.name}
+    ]
+
+def rebuild_rollups():
+    """Recalcula los acumulados desde cero a partir de las facturas activas y archivadas.
+    
+    La escritura de una factura y la de su acumulado no son atómicas entre sí;
+    este recálculo corrige cualquier desviación.
+    """
+    invoices_collection.aggregate(rollup_rebuild_pipeline())
+    return rollups_collection.count_documents({})
+
+# Segundos sugeridos al cliente mientras los acumulados se construyen
+ROLLUPS_RETRY_AFTER = 30
+
+def rollups_missing():
+    """True si ya hay facturas pero los acumulados aún no existen"""
+    return rollups_collection.estimated_document_count() == 0 and invoices_collection.estimated_document_count() > 0
+
+def ensure_rollups():
+    """Reconstruye los acumulados si aún no existen pero ya hay facturas.
+    
+    Sobre una base anterior a los acumulados, los $inc de las primeras
+    actualizaciones dejarían grupos parciales o negativos. Solo se ejecuta al
+    arrancar o con rebuild-rollups, nunca en una petición: el $out de la
+    reconstrucción descartaría los $inc de las escrituras concurrentes.
+    """
+    if rollups_missing():
+        rebuild_rollups()
+
+# ==================== ARCHIVO HISTÓRICO ====================
+
+# Estados finales: las facturas que llevan más de ARCHIVE_AFTER_DAYS en alguno de
+# ellos pasan a invoices_archive y salen de la colección principal
+ARCHIVE_STATES = ['pagada', 'cancelada']
+
+def archive_query(cutoff):
+    """Filtro de las facturas en estado final sin cambios desde antes de cutoff"""
+    return {
+        'estado': {'$in': ARCHIVE_STATES},
+        '$or': [
+            {'fecha_actualizacion': {'$lt': cutoff}},
+            {'fecha_actualizacion': None, 'fecha_creacion': {'$lt': cutoff}}
+        ]
+    }
+
+def archive_records(older_than_days=ARCHIVE_AFTER_DAYS, batch_size=ARCHIVE_BATCH_SIZE, on_batch=None):
+    """Mueve al archivo, por lotes, las facturas en estado final más antiguas que older_than_days.
+    
+    Cada lote se copia con upsert por _id y luego cada documento se borra de la
+    colección principal solo si no cambió desde que se leyó. Las copias cuyo borrado
+    no coincidió (el documento cambió o alguien lo eliminó en el medio) se quitan del
+    archivo. Así el proceso puede interrumpirse y repetirse sin perder ni duplicar.
+    """
+    cutoff = utcnow() - timedelta(days=older_than_days)
+    query = archive_query(cutoff)
+    archived = 0
+    last_id = None
+    
+    while True:
+        batch_query = {**query, '_id': {'$gt': last_id}} if last_id else query
+        batch = list(invoices_collection.find(batch_query).sort('_id', 1).limit(batch_size))
+        if not batch:
+            return archived
+        last_id = batch[-1]['_id']
+        
+        invoices_archive_collection.bulk_write([
+            ReplaceOne({'_id': document['_id']}, document, upsert=True) for document in batch
+        ], ordered=False)
+        # Un borrado por documento: el resultado de bulk_write no indica cuáles coincidieron
+        not_moved = [
+            document['_id'] for document in batch
+            if not invoices_collection.delete_one({
+                '_id': document['_id'],
+                'fecha_actualizacion': document.get('fecha_actualizacion')
+            }).deleted_count
+        ]
+        if not_moved:
+            invoices_archive_collection.delete_many({'_id': {'$in': not_moved}})
+        
+        archived += len(batch) - len(not_moved)
+        count_cache.clear()
+        for document in batch:
+            read_cache.delete(str(document['_id']))
+        if on_batch:
+            on_batch(archived)
+
+def count_invoices(query, include_archived=False, session=None):
+    """Total de facturas para la paginación por offset.
+    
+    Sin filtros usa la estimación de los metadatos de la colección, que no recorre
+    documentos; con filtros usa count_documents y guarda el resultado en count_cache.
+    """
+    collections = [invoices_reads, invoices_archive_reads] if include_archived else [invoices_reads]
+    if not query:
+        return sum(collection.estimated_document_count() for collection in collections)
+    
+    key = count_key(query, include_archived)
+    total = count_cache.get(key)
+    if total is None:
+        total = sum(collection.count_documents(query, session=session) for collection in collections)
+        count_cache.put(key, total)
+    return total
+
+def build_archive_pipeline(query, projection=None, search=False, position=None, skip=0, limit=10):
+    """Pipeline de listado sobre la colección principal y el archivo a la vez.
+    
+    Cada colección aporta sus primeros skip + limit documentos ya ordenados con sus
+    propios índices, y el resultado final solo mezcla esos candidatos.
+    """
+    if search:
+        branch = build_search_pipeline(query, position=position, limit=skip + limit)
+        sort = {'relevancia': -1, '_id': -1}
+    else:
+        branch = [
+            {'$match': apply_cursor(query, *position) if position else query},
+            {'$sort': dict(CURSOR_SORT)},
+            {'$limit': skip + limit}
+        ]
+        sort = dict(CURSOR_SORT)
+    
+    pipeline = branch + [
+        {'$unionWith': {'coll': ARCHIVE_COLLECTION_NAME, 'pipeline': branch}},
+        {'$sort': sort}
+    ]
+    if skip:
+        pipeline.append({'$skip': skip})
+    pipeline.append({'$limit': limit})
+    if projection:
+        pipeline.append({'$project': {**projection, 'relevancia': 1} if search else projection})
+    return pipeline
+
+# ==================== MIGRACIÓN DE FECHAS ====================
+
+def legacy_datetime(value):
+    """Convierte una fecha guardada como texto ISO en fecha UTC.
+    
+    Los textos sin zona se escribieron con datetime.now(), así que se interpretan en
+    la hora local del proceso (variable TZ). Lo que no es un texto ISO queda igual.
+    """
+    if not isinstance(value, str):
+        return value
+    try:
+        return datetime.fromisoformat(value).astimezone(timezone.utc)
+    except ValueError:
+        return value
+
+def date_changes(document):
+    """$set que reemplaza las fechas en texto de un documento por fechas UTC"""
+    changes = {}
+    for field in DATE_FIELDS:
+        value = document.get(field)
+        converted = legacy_datetime(value)
+        if converted is not value:
+            changes[field] = converted
+    
+    return changes
+
+def migrate_dates(batch_size=1000, on_batch=None):
+    """Convierte en el lugar, por lotes, las fechas en texto de las facturas (activas y archivadas).
+    
+    Cada documento se actualiza solo si sus fechas siguen siendo las que se leyeron,
+    así no se pisan cambios concurrentes y la migración puede repetirse hasta que
+    no quede nada por convertir.
+    """
+    query = {'$or': [{field: {'$type': 'string'}} for field in DATE_FIELDS]}
+    migrated = 0
+    
+    for collection in (invoices_collection, invoices_archive_collection):
+        last_id = None
+        while True:
+            batch_query = {**query, '_id': {'$gt': last_id}} if last_id else query
+            batch = list(collection.find(batch_query, DATE_FIELDS).sort('_id', 1).limit(batch_size))
+            if not batch:
+                break
+            last_id = batch[-1]['_id']
+            
+            operations = []
+            for document in batch:
+                changes = date_changes(document)
+                if changes:
+                    original = {field: document[field] for field in changes}
+                    operations.append(UpdateOne({'_id': document['_id'], **original}, {'$set': changes}))
+            if operations:
+                migrated += collection.bulk_write(operations, ordered=False).modified_count
+            if on_batch:
+                on_batch(migrated)
+    
+    return migrated
+
+# ==================== FEED DE CAMBIOS (SSE) ====================
+
+class EventBroker:
+    """Difusor en proceso de eventos de cambio, con historial acotado para reanudar.
+    
+    Los eventos publicados por las rutas se identifican como <epoch>-<secuencia>;
+    los del change stream usan su resume token, que es común a todos los procesos y
+    crece con cada cambio. Un identificador desconocido o más antiguo que el
+    historial obliga al cliente a recargar (evento 'reset').
+    """
+    
+    def __init__(self, history_size):
+        self.epoch = format(time.time_ns(), 'x')
+        self._sequence = 0
+        self._history = deque(maxlen=history_size)
+        self._condition = threading.Condition()
+    
+    def publish(self, event_type, document, event_id=None):
+        """Registra un evento y despierta a los suscriptores"""
+        with self._condition:
+            self._sequence += 1
+            self._history.append({
+                'seq': self._sequence,
+                'id': event_id or f'{self.epoch}-{self._sequence}',
+                'type': event_type,
+                'data': document
+            })
+            self._condition.notify_all()
+    
+    def position(self, last_event_id):
+        """Secuencia desde la cual continuar un suscriptor. Retorna (secuencia, reset)"""
+        with self._condition:
+            if not last_event_id:
+                return self._sequence, False
+            
+            epoch, _, sequence = last_event_id.partition('-')
+            oldest = self._history[0]['seq'] if self._history else self._sequence + 1
+            if epoch == self.epoch and sequence.isdigit() and oldest - 1 <= int(sequence) <= self._sequence:
+                return int(sequence), False
+            
+            # Resume token del change stream visto por cualquier proceso
+            for event in self._history:
+                if event['id'] == last_event_id:
+                    return event['seq'], False
+            if self._history and not sequence and last_event_id > self._history[-1]['id']:
+                return self._sequence, False  # este proceso aún no recibe ese cambio
+            return self._sequence, True
+    
+    def events_after(self, sequence, timeout=0):
+        """Eventos posteriores a la secuencia; si no hay, espera hasta timeout segundos"""
+        with self._condition:
+            if self._sequence <= sequence and timeout:
+                self._condition.wait(timeout)
+            return [event for event in self._history if event['seq'] > sequence]
+
+event_broker = EventBroker(SSE_HISTORY_SIZE)
+
+def publish_event(event_type, document):
+    """Publica un cambio hecho por una ruta (en modo changestream lo publica el watcher)"""
+    count_cache.clear()
+    if CHANGE_FEED_SOURCE == 'local':
+        event_broker.publish(event_type, document)
+
+def event_matches(event, filters):
+    """Indica si un evento cumple los filtros del suscriptor.
+    
+    Los campos ausentes (p. ej. en eliminaciones del change stream) no filtran.
+    """
+    document = event['data']
+    return all(document.get(field, value) == value for field, value in filters.items())
+
+def format_sse(event):
+    """Serializa un evento en el formato de Server-Sent Events"""
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {app.json.dumps(event['data'])}\n\n"
+
+def format_reset(sequence):
+    """Evento que indica al cliente que debe recargar porque se perdieron eventos"""
+    return f'id: {event_broker.epoch}-{sequence}\nevent: reset\ndata: {{}}\n\n'
+
+def stream_events(sequence, reset, filters):
+    """Generador SSE: emite los eventos que cumplen los filtros y latidos periódicos"""
+    yield 'retry: 3000\n\n'
+    if reset:
+        yield format_reset(sequence)
+    
+    while True:
+        events = event_broker.events_after(sequence, SSE_HEARTBEAT)
+        if not events:
+            yield ': keepalive\n\n'
+            continue
+        
+        for event in events:
+            sequence = event['seq']
+            if event_matches(event, filters):
+                yield format_sse(event)
+
+# Tipos de operación del change stream y su evento equivalente
+CHANGE_STREAM_EVENTS = {
+    'insert': 'create',
+    'update': 'update',
+    'replace': 'update',
+    'delete': 'delete'
+}
+
+_watcher_lock = threading.Lock()
+_watcher_started = False
+
+def watch_changes():
+    """Publica en el broker los cambios del change stream de la colección (requiere replica set)"""
+    resume_token = None
+    while True:
+        try:
+            with invoices_collection.watch(full_document='updateLookup', resume_after=resume_token) as stream:
+                for change in stream:
+                    resume_token = stream.resume_token
+                    event_type = CHANGE_STREAM_EVENTS.get(change['operationType'])
+                    if event_type:
+                        count_cache.clear()
+                        event_broker.publish(event_type, change.get('fullDocument') or change['documentKey'], change['_id']['_data'])
+        except PyMongoError:
+            time.sleep(1)
+
+def ensure_change_watcher():
+    """Inicia el watcher del change stream una sola vez por proceso, al primer suscriptor"""
+    global _watcher_started
+    if CHANGE_FEED_SOURCE != 'changestream':
+        return
+    
+    with _watcher_lock:
+        if not _watcher_started:
+            threading.Thread(target=watch_changes, name='change-stream', daemon=True).start()
+            _watcher_started = True
+
+# ==================== CARGA MASIVA ====================
+
+NDJSON_MIMETYPES = ('application/x-ndjson', 'application/ndjson')
+
+def iter_ndjson_records(stream):
+    """Lee un cuerpo NDJSON línea por línea. Produce (registro, error)"""
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line), None
+        except ValueError:
+            yield None, 'JSON inválido'
+
+def bulk_write_failures(error):
+    """Errores por posición de un BulkWriteError y el motivo si el resto del bloque quedó sin confirmar.
+    
+    Con writeConcernErrors, o sin writeErrors que expliquen el fallo, no hay garantía
+    de que los demás documentos del bloque estén escritos con el write concern pedido.
+    """
+    failed = {item['index']: item['errmsg'] for item in error.details.get('writeErrors', [])}
+    concern_errors = error.details.get('writeConcernErrors')
+    if concern_errors:
+        return failed, f"Escritura sin confirmar: {concern_errors[0].get('errmsg')}"
+    if not failed:
+        return failed, f'Escritura sin confirmar: {error}'
+    return failed, None
+
+def bulk_insert(collection, records, validate, build, chunk_size, on_insert=None, session=None):
+    """Valida e inserta registros en bloques con insert_many no ordenado.
+    
+    records es un iterable de (registro, error). on_insert, si se indica, recibe
+    los documentos insertados de cada bloque. Retorna el reporte por registro en
+    el mismo orden de entrada.
+    """
+    results = []
+    chunk, positions = [], []
+    
+    def flush():
+        failed, unconfirmed = {}, None
+        try:
+            collection.insert_many(chunk, ordered=False, session=session)
+        except BulkWriteError as e:
+            failed, unconfirmed = bulk_write_failures(e)
+        
+        for offset, (position, document) in enumerate(zip(positions, chunk)):
+            if offset in failed:
+                results[position] = {'index': position, 'success': False, 'message': failed[offset]}
+            elif unconfirmed:
+                # Probablemente escrito en el primario: se informa el _id para que el cliente lo verifique
+                results[position] = {'index': position, 'success': False, 'message': unconfirmed, '_id': str(document['_id'])}
+            else:
+                results[position] = {'index': position, 'success': True, '_id': str(document['_id'])}
+        
+        if on_insert:
+            on_insert([document for offset, document in enumerate(chunk) if offset not in failed], session=session)
+        chunk.clear()
+        positions.clear()
+    
+    for position, (record, error) in enumerate(records):
+        error = error or validate(record)
+        if error:
+            results.append({'index': position, 'success': False, 'message': error})
+            continue
+        
+        try:
+            document = build(record)
+        except Exception as e:
+            results.append({'index': position, 'success': False, 'message': str(e)})
+            continue
+        
+        results.append(None)
+        chunk.append(document)
+        positions.append(position)
+        if len(chunk) >= chunk_size:
+            flush()
+    
+    if chunk:
+        flush()
+    
+    return results
+
+# ==================== CONSULTA EN LOTE ====================
+
+# Claves aceptadas por batch-get y el campo del documento con el que se comparan
+BATCH_GET_FIELDS = {'ids': '_id', 'numero_factura': 'numero_factura', 'cliente_id': 'cliente_id'}
+
+def parse_batch_get(data):
+    """Valida el cuerpo de batch-get. Retorna (campo, valores sin duplicados, error)"""
+    keys = [key for key in BATCH_GET_FIELDS if key in data] if isinstance(data, dict) else []
+    if len(keys) != 1:
+        return None, None, f"Indique exactamente una de las claves: {', '.join(BATCH_GET_FIELDS)}"
+    
+    key = keys[0]
+    values = data[key]
+    if not isinstance(values, list) or not values or len(values) > BATCH_GET_MAX:
+        return None, None, f'{key} debe ser una lista de 1 a {BATCH_GET_MAX} valores'
+    if not all(isinstance(value, str) for value in values):
+        return None, None, f'{key} solo admite textos'
+    if key == 'ids':
+        if not all(ObjectId.is_valid(value) for value in values):
+            return None, None, 'ids contiene identificadores inválidos'
+        # Forma canónica (hex en minúsculas), la misma con la que order_batch agrupa
+        values = [str(ObjectId(value)) for value in values]
+    
+    return BATCH_GET_FIELDS[key], list(dict.fromkeys(values)), None
+
+def batch_get_query(field, values):
+    """Filtro $in sobre el campo indexado correspondiente"""
+    if field == '_id':
+        values = [ObjectId(value) for value in values]
+    return {field: {'$in': values}}
+
+def order_batch(documents, field, values):
+    """Ordena los documentos según los valores pedidos. Retorna (documentos, valores sin resultados)"""
+    groups = {}
+    for document in documents:
+        groups.setdefault(str(document.get(field)), []).append(document)
+    
+    ordered, missing = [], []
+    for value in values:
+        if value in groups:
+            ordered.extend(groups[value])
+        else:
+            missing.append(value)
+    
+    return ordered, missing
+
+# ==================== EXPORTACIÓN ====================
+
+EXPORT_MIMETYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv'
+}
+
+EXPORT_COLUMNS = [
+    '_id', 'numero_factura', 'cliente_id', 'cliente_nombre', 'items', 'subtotal',
+    'iva', 'total', 'estado', 'usuario_id', 'fecha_creacion', 'fecha_pago',
+    'fecha_actualizacion', 'notas'
+]
+
+def _csv_value(value):
+    """Convierte un valor del documento en una celda CSV"""
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, default=_json_default, ensure_ascii=False)
+    return value
+
+def export_rows(cursor, export_format, columns):
+    """Serializa un cursor de Mongo como NDJSON o CSV, emitiendo un lote a la vez"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    
+    try:
+        if export_format == 'csv':
+            writer.writerow(columns)
+        
+        for count, document in enumerate(cursor, 1):
+            if export_format == 'csv':
+                writer.writerow([_csv_value(document.get(column)) for column in columns])
+            else:
+                buffer.write(json.dumps(document, default=_json_default, ensure_ascii=False))
+                buffer.write('\n')
+            
+            if count % EXPORT_BATCH_SIZE == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        
+        yield buffer.getvalue()
+    finally:
+        cursor.close()
+
 # ==================== RUTAS ====================
 
 @app.route('/api/health', methods=['GET'])
@@ -72,7 +1729,7 @@ def health():
     return jsonify({
         'success': True,
         'message': 'Microservicio de Facturación funcionando',
-        'timestamp': datetime.now().isoformat()
+        'timestamp': utcnow()
     })
 
 @app.route('/api/invoices', methods=['GET'])
@@ -82,26 +1739,109 @@ def list_invoices():
     try:
         # Parámetros de filtro
         page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 10, type=int)
-        estado = request.args.get('estado')
-        cliente_id = request.args.get('cliente_id')
+        per_page = min(request.args.get('per_page', 10, type=int), MAX_PER_PAGE)
+        cursor = request.args.get('cursor')  # presente (aunque vacío) activa el modo cursor
+        include_archived = request.args.get('include_archived') == 'true'
+        with_total = request.args.get('with_total') != 'false'  # false: solo has_more, sin contar
+        if page < 1 or per_page < 1:
+            return jsonify({
+                'success': False,
+                'message': 'page y per_page deben ser mayores que 0'
+            }), 400
         
         # Construcción de filtro
-        query = {}
-        if estado:
-            query['estado'] = estado
-        if cliente_id:
-            query['cliente_id'] = cliente_id
+        query = build_list_query(request.args)
+        date_range, error = parse_date_range(request.args)
+        if error:
+            return jsonify({
+                'success': False,
+                'message': error
+            }), 400
+        if date_range:
+            query['fecha_creacion'] = date_range
         
-        # Paginación
+        # Búsqueda libre sobre el índice de texto (q=); los resultados se ordenan por relevancia
+        search = request.args.get('q', '').strip()
+        if len(search) > SEARCH_MAX_LENGTH:
+            return jsonify({
+                'success': False,
+                'message': f'q no puede superar {SEARCH_MAX_LENGTH} caracteres'
+            }), 400
+        if search:
+            query['$text'] = {'$search': search}
+        cursor_field = 'relevancia' if search else 'fecha_creacion'
+        
+        # Proyección de campos solicitados (fields=a,b,c)
+        projection, error = parse_fields(request.args.get('fields'))
+        if error:
+            return jsonify({
+                'success': False,
+                'message': error
+            }), 400
+        
+        # Paginación por cursor: cada página cuesta lo mismo sin importar su profundidad
+        if cursor is not None:
+            position = None
+            if cursor:
+                position = decode_cursor(cursor, cursor_field)
+                if position is None:
+                    return jsonify({
+                        'success': False,
+                        'message': 'Cursor inválido'
+                    }), 400
+            
+            # La clave de orden es necesaria para generar el siguiente cursor
+            if projection and not search:
+                projection['fecha_creacion'] = 1
+            
+            if include_archived:
+                invoices = list(invoices_reads.aggregate(build_archive_pipeline(query, projection, search, position, limit=per_page + 1), session=db_session()))
+            elif search:
+                invoices = list(invoices_reads.aggregate(build_search_pipeline(query, projection, position, limit=per_page + 1), session=db_session()))
+            else:
+                if position:
+                    query = apply_cursor(query, *position)
+                invoices = list(invoices_reads.find(query, projection, session=db_session()).sort(CURSOR_SORT).limit(per_page + 1))
+            
+            has_more = len(invoices) > per_page
+            invoices = invoices[:per_page]
+            next_cursor = encode_cursor(invoices[-1], cursor_field) if has_more else None
+            
+            return jsonify({
+                'success': True,
+                'message': 'Facturas obtenidas correctamente',
+                'data': invoices,
+                'pagination': {
+                    'per_page': per_page,
+                    'next_cursor': next_cursor,
+                    'has_more': has_more
+                }
+            }), 200
+        
+        # Paginación por offset, con el mismo orden estable que el modo cursor
         skip = (page - 1) * per_page
-        total = invoices_collection.count_documents(query)
+        limit = per_page if with_total else per_page + 1
         
-        invoices = list(invoices_collection.find(query).skip(skip).limit(per_page))
+        if include_archived:
+            invoices = list(invoices_reads.aggregate(build_archive_pipeline(query, projection, search, skip=skip, limit=limit), session=db_session()))
+        elif search:
+            invoices = list(invoices_reads.aggregate(build_search_pipeline(query, projection, skip=skip, limit=limit), session=db_session()))
+        else:
+            invoices = list(invoices_reads.find(query, projection, session=db_session()).sort(CURSOR_SORT).skip(skip).limit(limit))
         
-        # Convertir ObjectId a string
-        for invoice in invoices:
-            invoice['_id'] = str(invoice['_id'])
+        if not with_total:
+            return jsonify({
+                'success': True,
+                'message': 'Facturas obtenidas correctamente',
+                'data': invoices[:per_page],
+                'pagination': {
+                    'page': page,
+                    'per_page': per_page,
+                    'has_more': len(invoices) > per_page
+                }
+            }), 200
+        
+        total = count_invoices(query, include_archived, db_session())
         
         return jsonify({
             'success': True,
@@ -125,46 +1865,20 @@ def create_invoice():
         data = request.get_json()
         
         # Validación
-        required_fields = ['numero_factura', 'cliente_id', 'cliente_nombre', 'items']
-        for field in required_fields:
-            if not data.get(field):
-                return jsonify({
-                    'success': False,
-                    'message': f'Campo requerido: {field}'
-                }), 400
-        
-        if not isinstance(data.get('items'), list) or len(data['items']) == 0:
+        error = validate_invoice(data)
+        if error:
             return jsonify({
                 'success': False,
-                'message': 'items debe ser una lista no vacía'
+                'message': error
             }), 400
         
-        # Cálcular totales
-        subtotal = 0
-        for item in data['items']:
-            subtotal += item.get('cantidad', 0) * item.get('precio_unitario', 0)
-        
-        iva = subtotal * 0.19  # IVA 19%
-        total = subtotal + iva
-        
         # Crear factura
-        invoice = {
-            'numero_factura': data['numero_factura'],
-            'cliente_id': data['cliente_id'],
-            'cliente_nombre': data['cliente_nombre'],
-            'items': data['items'],
-            'subtotal': subtotal,
-            'iva': iva,
-            'total': total,
-            'estado': data.get('estado', 'pendiente'),  # pendiente, pagada, cancelada
-            'usuario_id': request.user.get('id'),
-            'fecha_creacion': datetime.now().isoformat(),
-            'fecha_pago': data.get('fecha_pago'),
-            'notas': data.get('notas', '')
-        }
+        invoice = build_invoice(data, request.user.get('id'))
         
-        result = invoices_collection.insert_one(invoice)
+        result = invoices_collection.insert_one(invoice, session=db_session())
         invoice['_id'] = str(result.inserted_id)
+        apply_rollups([(invoice, 1)], session=db_session())
+        publish_event('create', invoice)
         
         return jsonify({
             'success': True,
@@ -174,28 +1888,233 @@ def create_invoice():
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
-@app.route('/api/invoices/<invoice_id>', methods=['GET'])
+@app.route('/api/invoices/export', methods=['GET'])
 @require_auth
-def get_invoice(invoice_id):
-    """Obtener una factura específica"""
+def export_invoices():
+    """Exportar las facturas filtradas como NDJSON o CSV (streaming)"""
     try:
-        invoice = invoices_collection.find_one({'_id': ObjectId(invoice_id)})
+        export_format = request.args.get('format', 'ndjson')
+        if export_format not in EXPORT_MIMETYPES:
+            return jsonify({
+                'success': False,
+                'message': 'Formato inválido. Debe ser: ndjson, csv'
+            }), 400
         
-        if not invoice:
+        query = build_list_query(request.args)
+        date_range, error = parse_date_range(request.args)
+        if error:
             return jsonify({
                 'success': False,
-                'message': 'Factura no encontrada'
-            }), 404
+                'message': error
+            }), 400
+        if date_range:
+            query['fecha_creacion'] = date_range
+        # El cuerpo se transmite después de cerrar la petición y su sesión: la exportación
+        # usa la preferencia enrutada sin lectura causal
+        cursor = invoices_reads.find(query, batch_size=EXPORT_BATCH_SIZE)
+        
+        return Response(
+            export_rows(cursor, export_format, EXPORT_COLUMNS),
+            mimetype=EXPORT_MIMETYPES[export_format],
+            headers={'Content-Disposition': f'attachment; filename=invoices.{export_format}'}
+        )
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/api/invoices/bulk', methods=['POST'])
+@require_auth
+def bulk_create_invoices():
+    """Crear facturas en lote (arreglo JSON o NDJSON)"""
+    try:
+        chunk_size = max(request.args.get('chunk_size', BULK_CHUNK_SIZE, type=int), 1)
+        
+        if request.mimetype in NDJSON_MIMETYPES:
+            records = iter_ndjson_records(request.stream)
+        else:
+            data = request.get_json(silent=True)
+            if not isinstance(data, list):
+                return jsonify({
+                    'success': False,
+                    'message': 'Se esperaba un arreglo JSON o un cuerpo NDJSON'
+                }), 400
+            records = ((record, None) for record in data)
+        
+        build = functools.partial(build_invoice, user_id=request.user.get('id'))
+        results = bulk_insert(invoices_collection, records, validate_invoice, build, chunk_size, invoices_inserted, db_session())
+        inserted = sum(1 for result in results if result['success'])
+        failed = len(results) - inserted
+        
+        return jsonify({
+            'success': failed == 0,
+            'message': f'{inserted} facturas creadas, {failed} con errores',
+            'data': {
+                'inserted': inserted,
+                'failed': failed,
+                'results': results
+            }
+        }), 201 if failed == 0 else 207
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/api/invoices/batch-get', methods=['POST'])
+@require_auth
+def batch_get_invoices():
+    """Obtener varias facturas por id, número o cliente en una sola consulta, en el orden pedido"""
+    try:
+        data = request.get_json(silent=True)
+        field, values, error = parse_batch_get(data)
+        if error:
+            return jsonify({
+                'success': False,
+                'message': error
+            }), 400
+        
+        projection, error = parse_fields(request.args.get('fields'))
+        if error:
+            return jsonify({
+                'success': False,
+                'message': error
+            }), 400
+        if projection:
+            projection[field] = 1
         
-        invoice['_id'] = str(invoice['_id'])
+        # Por cliente puede haber muchos documentos: se entregan los más recientes
+        # hasta BATCH_GET_MAX y se indica si quedaron más
+        cursor = invoices_collection.find(batch_get_query(field, values), projection)
+        if field == 'cliente_id':
+            cursor = cursor.sort(CURSOR_SORT)
+        invoices = list(cursor.limit(BATCH_GET_MAX + 1))
+        truncated = len(invoices) > BATCH_GET_MAX
+        invoices, missing = order_batch(invoices[:BATCH_GET_MAX], field, values)
         
         return jsonify({
             'success': True,
-            'data': invoice
+            'message': 'Facturas obtenidas correctamente',
+            'data': invoices,
+            'missing': missing,
+            'truncated': truncated
         }), 200
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
+@app.route('/api/invoices/report', methods=['GET'])
+@require_auth
+def billing_report():
+    """Totales de facturación por cliente, estado y/o mes desde los acumulados"""
+    try:
+        group_by = request.args.get('group_by', ','.join(ROLLUP_KEYS)).split(',')
+        if not group_by or any(key not in ROLLUP_KEYS for key in group_by):
+            return jsonify({
+                'success': False,
+                'message': f'group_by inválido. Debe combinar: {", ".join(ROLLUP_KEYS)}'
+            }), 400
+        
+        match = {'cantidad': {'$gt': 0}}
+        for key in ['cliente_id', 'estado']:
+            if request.args.get(key):
+                match[key] = request.args.get(key)
+        
+        # Rango de meses en formato YYYY-MM
+        months = {}
+        if request.args.get('mes_desde'):
+            months['$gte'] = request.args.get('mes_desde')
+        if request.args.get('mes_hasta'):
+            months['$lte'] = request.args.get('mes_hasta')
+        if months:
+            match['mes'] = months
+        
+        # Los acumulados se construyen al arrancar o con rebuild-rollups, nunca aquí
+        if rollups_missing():
+            return rollups_unavailable()
+        
+        groups = list(rollups_reads.aggregate([
+            {'$match': match},
+            {'$group': {
+                '_id': {key: f'${key}' for key in group_by},
+                'cantidad': {'$sum': '$cantidad'},
+                **{field: {'$sum': f'${field}'} for field in ROLLUP_AMOUNTS}
+            }},
+            {'$sort': {f'_id.{key}': 1 for key in group_by}}
+        ], session=db_session()))
+        
+        data = [{**group.pop('_id'), **group} for group in groups]
+        
+        return jsonify({
+            'success': True,
+            'message': 'Reporte de facturación obtenido correctamente',
+            'data': data
+        }), 200
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+def rollups_unavailable():
+    """Respuesta 503 mientras los acumulados no existen"""
+    return jsonify({
+        'success': False,
+        'message': 'Los acumulados de facturación se están construyendo (o ejecute flask --app app rebuild-rollups)'
+    }), 503, {'Retry-After': str(ROLLUPS_RETRY_AFTER)}
+
+@app.route('/api/invoices/events', methods=['GET'])
+@require_auth
+def invoice_events():
+    """Feed de cambios de facturas (Server-Sent Events)"""
+    try:
+        # Los mismos filtros del listado; Last-Event-ID permite reanudar tras una reconexión
+        filters = build_list_query(request.args)
+        last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+        
+        ensure_change_watcher()
+        sequence, reset = event_broker.position(last_event_id)
+        
+        return Response(
+            stream_events(sequence, reset, filters),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/api/invoices/<invoice_id>', methods=['GET'])
+@require_auth
+def get_invoice(invoice_id):
+    """Obtener una factura específica"""
+    try:
+        entry = read_cache.get(invoice_id)
+        if entry is None:
+            # Generación previa a la lectura: si una escritura la invalida mientras tanto, no se guarda
+            generation = read_cache.generation
+            invoice = invoices_collection.find_one({'_id': ObjectId(invoice_id)})
+            
+            # Las facturas archivadas solo se buscan a pedido y no pasan por el caché
+            archived = False
+            if not invoice and request.args.get('include_archived') == 'true':
+                invoice = invoices_archive_collection.find_one({'_id': ObjectId(invoice_id)})
+                archived = invoice is not None
+            
+            if not invoice:
+                return jsonify({
+                    'success': False,
+                    'message': 'Factura no encontrada'
+                }), 404
+            
+            invoice['_id'] = str(invoice['_id'])
+            entry = (invoice, document_etag(invoice))
+            if not archived:
+                read_cache.put(invoice_id, entry, generation=generation)
+        
+        invoice, etag = entry
+        if request.if_none_match.contains_weak(etag):
+            return not_modified(etag)
+        
+        response = jsonify({
+            'success': True,
+            'data': invoice
+        })
+        response.set_etag(etag)
+        return response, 200
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
 @app.route('/api/invoices/<invoice_id>', methods=['PUT'])
 @require_auth
 def update_invoice(invoice_id):
@@ -203,26 +2122,32 @@ def update_invoice(invoice_id):
     try:
         data = request.get_json()
         
-        invoice = invoices_collection.find_one({'_id': ObjectId(invoice_id)})
-        if not invoice:
-            return jsonify({
-                'success': False,
-                'message': 'Factura no encontrada'
-            }), 404
-        
         # Campos permitidos para actualizar
         allowed_fields = ['estado', 'notas', 'fecha_pago', 'cliente_nombre']
         update_data = {key: data[key] for key in allowed_fields if key in data}
         
+        error = parse_date_fields(update_data, ['fecha_pago'])
+        if error:
+            return jsonify({
+                'success': False,
+                'message': error
+            }), 400
+        
         if update_data:
-            update_data['fecha_actualizacion'] = datetime.now().isoformat()
-            invoices_collection.update_one(
-                {'_id': ObjectId(invoice_id)},
-                {'$set': update_data}
-            )
+            update_data['fecha_actualizacion'] = utcnow()
+            updated_invoice = update_invoice_tracked(ObjectId(invoice_id), {'$set': update_data}, session=db_session())
+        else:
+            updated_invoice = invoices_collection.find_one({'_id': ObjectId(invoice_id)}, session=db_session())
+        
+        if not updated_invoice:
+            return jsonify({
+                'success': False,
+                'message': 'Factura no encontrada'
+            }), 404
         
-        updated_invoice = invoices_collection.find_one({'_id': ObjectId(invoice_id)})
+        read_cache.delete(invoice_id)
         updated_invoice['_id'] = str(updated_invoice['_id'])
+        publish_event('update', updated_invoice)
         
         return jsonify({
             'success': True,
@@ -237,14 +2162,16 @@ def update_invoice(invoice_id):
 def delete_invoice(invoice_id):
     """Eliminar una factura"""
     try:
-        invoice = invoices_collection.find_one({'_id': ObjectId(invoice_id)})
+        invoice = invoices_collection.find_one_and_delete({'_id': ObjectId(invoice_id)}, session=db_session())
         if not invoice:
             return jsonify({
                 'success': False,
                 'message': 'Factura no encontrada'
             }), 404
         
-        invoices_collection.delete_one({'_id': ObjectId(invoice_id)})
+        read_cache.delete(invoice_id)
+        apply_rollups([(invoice, -1)], session=db_session())
+        publish_event('delete', invoice)
         
         return jsonify({
             'success': True,
@@ -258,24 +2185,22 @@ def delete_invoice(invoice_id):
 def mark_as_paid(invoice_id):
     """Marcar factura como pagada"""
     try:
-        invoice = invoices_collection.find_one({'_id': ObjectId(invoice_id)})
-        if not invoice:
+        now = utcnow()
+        payment = {
+            'estado': 'pagada',
+            'fecha_pago': now,
+            'fecha_actualizacion': now
+        }
+        updated_invoice = update_invoice_tracked(ObjectId(invoice_id), {'$set': payment}, session=db_session())
+        if not updated_invoice:
             return jsonify({
                 'success': False,
                 'message': 'Factura no encontrada'
             }), 404
         
-        invoices_collection.update_one(
-            {'_id': ObjectId(invoice_id)},
-            {'$set': {
-                'estado': 'pagada',
-                'fecha_pago': datetime.now().isoformat(),
-                'fecha_actualizacion': datetime.now().isoformat()
-            }}
-        )
-        
-        updated_invoice = invoices_collection.find_one({'_id': ObjectId(invoice_id)})
+        read_cache.delete(invoice_id)
         updated_invoice['_id'] = str(updated_invoice['_id'])
+        publish_event('pay', updated_invoice)
         
         return jsonify({
             'success': True,
@@ -285,6 +2210,34 @@ def mark_as_paid(invoice_id):
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    """Métricas en formato de exposición de Prometheus"""
+    return Response(render_metrics(), mimetype=CONTENT_TYPE_LATEST)
+
+@app.route('/api/diagnostics/indexes', methods=['GET'])
+@require_auth
+def index_report():
+    """Reporte de uso de índices (explain) para las combinaciones de filtros del listado"""
+    try:
+        limit = request.args.get('limit', 10, type=int)
+        
+        return jsonify({
+            'success': True,
+            'data': build_index_report(limit)
+        }), 200
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/api/diagnostics/token-cache', methods=['GET'])
+@require_auth
+def token_cache_stats():
+    """Estadísticas del caché de tokens verificados"""
+    return jsonify({
+        'success': True,
+        'data': token_cache.stats()
+    }), 200
+
 # ==================== MANEJO DE ERRORES ====================
 
 @app.errorhandler(404)
@@ -301,7 +2254,51 @@ def server_error(error):
         'message': 'Error interno del servidor'
     }), 500
 
+# ==================== COMANDOS CLI ====================
+
+@app.cli.command('ensure-indexes')
+def ensure_indexes_command():
+    """Crea los índices declarados (idempotente, una vez por despliegue): flask --app app ensure-indexes"""
+    ensure_indexes()
+    click.echo('Índices verificados')
+
+@app.cli.command('index-report')
+@click.option('--limit', default=10, help='Tamaño de página usado en cada explain')
+@click.option('--fail-on-collscan', is_flag=True, help='Termina con error si alguna consulta hace COLLSCAN')
+def index_report_command(limit, fail_on_collscan):
+    """Imprime el reporte de índices en JSON: flask --app app index-report"""
+    report = build_index_report(limit)
+    click.echo(json.dumps(report, indent=2, default=str))
+    
+    if fail_on_collscan and report['collscans']:
+        raise SystemExit(1)
+
+@app.cli.command('rebuild-rollups')
+def rebuild_rollups_command():
+    """Recalcula los acumulados de facturación: flask --app app rebuild-rollups"""
+    groups = rebuild_rollups()
+    click.echo(f'Acumulados recalculados: {groups} grupos')
+
+@app.cli.command('archive-records')
+@click.option('--older-than-days', default=ARCHIVE_AFTER_DAYS, type=float, help='Antigüedad mínima en estado final')
+@click.option('--batch-size', default=ARCHIVE_BATCH_SIZE, help='Documentos por lote')
+def archive_records_command(older_than_days, batch_size):
+    """Mueve al archivo las facturas en estado final antiguas (reanudable): flask --app app archive-records"""
+    total = archive_records(older_than_days, batch_size, on_batch=lambda archived: click.echo(f'{archived} archivadas'))
+    click.echo(f'Archivo completo: {total} facturas movidas')
+
+@app.cli.command('migrate-dates')
+@click.option('--batch-size', default=1000, help='Documentos por lote')
+def migrate_dates_command(batch_size):
+    """Convierte las fechas guardadas como texto en fechas BSON UTC (reanudable): flask --app app migrate-dates"""
+    total = migrate_dates(batch_size, on_batch=lambda migrated: click.echo(f'{migrated} migradas'))
+    click.echo(f'Migración completa: {total} facturas actualizadas')
+    groups = rebuild_rollups()
+    click.echo(f'Acumulados recalculados con meses en UTC: {groups} grupos')
+
 # ==================== MAIN ====================
 
 if __name__ == '__main__':
-    app.run(debug=True, host='127.0.0.1', port=5000)
+    # Servidor de desarrollo; en producción se usa gunicorn -c gunicorn.conf.py app:app
+    start_index_bootstrap()
+    app.run(debug=os.getenv('FLASK_DEBUG', '0') == '1', host='127.0.0.1', port=5000)
@@ -0,0 +1,921 @@
+"""Punto de entrada asíncrono (ASGI) del Microservicio de Facturación.
+
+Expone las mismas rutas y el mismo contrato JSON que app.py, pero cada ruta es
+una corrutina sobre el cliente no bloqueante de MongoDB (Motor), de modo que un
+solo proceso puede mantener miles de peticiones en espera de la base de datos.
+
+Las reglas de validación, construcción de documentos, filtros y cursores se
+reutilizan desde app.py. Las rutas de diagnóstico siguen sirviéndose desde app.py.
+
+El feed de cambios comparte el broker en proceso de app.py; aquí los
+suscriptores lo consultan periódicamente en lugar de bloquear un hilo.
+
+Ejecutar con:
+    hypercorn app_async:app --bind 0.0.0.0:5000
+"""
+from quart import Quart, Response, request, jsonify, g
+from quart.wrappers.response import DataBody, IterableBody
+from quart_cors import cors
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError
+from bson.objectid import ObjectId
+import asyncio
+import csv
+import functools
+import io
+import json
+import time
+
+from prometheus_client import CONTENT_TYPE_LATEST
+
+from app import (
+    MONGO_URI, MONGO_DB_NAME, BULK_CHUNK_SIZE, EXPORT_BATCH_SIZE,
+    CURSOR_SORT, EXPORT_COLUMNS, EXPORT_MIMETYPES, NDJSON_MIMETYPES,
+    FastJSONProvider, verify_token, parse_fields, validate_invoice, build_invoice, build_list_query, read_cache, document_etag,
+    ROUTED_READ_PREFERENCE, CAUSAL_TOKEN_HEADER, encode_causal_token, advance_session,
+    count_cache, count_key,
+    encode_cursor, decode_cursor, apply_cursor, build_search_pipeline, SEARCH_MAX_LENGTH, iter_ndjson_records, _csv_value, _json_default,
+    ROLLUP_KEYS, ROLLUP_AMOUNTS, rollup_updates, ROLLUPS_RETRY_AFTER, ROLLUP_FIELDS, rollup_guard,
+    MONGO_LISTENERS, http_request_duration, render_metrics, start_index_bootstrap,
+    utcnow, parse_date_fields, parse_date_range,
+    build_archive_pipeline, MAX_PER_PAGE, BATCH_GET_MAX, parse_batch_get, batch_get_query, order_batch, bulk_write_failures,
+    COMPRESSION_ENCODINGS, COMPRESSION_MIN_SIZE, compress_body, compressible, mark_compressed,
+    MAX_IN_FLIGHT, ADMISSION_QUEUE_SIZE, ADMISSION_QUEUE_TIMEOUT, ADMISSION_RETRY_AFTER, LONG_LIVED_ROUTES, AdmissionSlot,
+    route_class, rate_limit_retry_after, admission_rejections,
+    SSE_HEARTBEAT, SSE_MAX_CONNECTIONS, event_broker, publish_event, event_matches, format_sse, format_reset, ensure_change_watcher
+)
+
+app = Quart(__name__)
+app.json = FastJSONProvider(app)
+app = cors(app)
+
+# Intervalo de consulta del broker para los suscriptores SSE (segundos)
+SSE_POLL_INTERVAL = 0.5
+
+# Conexión no bloqueante a MongoDB
+client = AsyncIOMotorClient(MONGO_URI, tz_aware=True, event_listeners=MONGO_LISTENERS)
+db = client[MONGO_DB_NAME]
+invoices_collection = db['invoices']
+rollups_collection = db['invoice_rollups']
+invoices_archive_collection = db['invoices_archive']
+invoices_reads = invoices_collection.with_options(read_preference=ROUTED_READ_PREFERENCE)
+invoices_archive_reads = invoices_archive_collection.with_options(read_preference=ROUTED_READ_PREFERENCE)
+rollups_reads = rollups_collection.with_options(read_preference=ROUTED_READ_PREFERENCE)
+
+@app.before_serving
+async def bootstrap_indexes():
+    """Crea los índices en segundo plano sin retrasar el arranque"""
+    start_index_bootstrap()
+
+@app.before_request
+async def start_request_timer():
+    """Marca el inicio de la petición para medir su latencia"""
+    g.request_start = time.perf_counter()
+
+class AdmissionBody:
+    """Cuerpo en streaming que libera el lugar de admisión cuando termina de enviarse"""
+    
+    def __init__(self, body, slot):
+        self.body = body
+        self.slot = slot
+    
+    async def __aenter__(self):
+        await self.body.__aenter__()
+        return self
+    
+    async def __aexit__(self, exc_type, exc_value, tb):
+        try:
+            await self.body.__aexit__(exc_type, exc_value, tb)
+        finally:
+            self.slot.release()
+    
+    def __aiter__(self):
+        return self.body.__aiter__()
+
+# Quart ejecuta los after_request en orden inverso al registro: este se registra antes
+# que los del servicio para correr después de ellos (solo lo sigue el de CORS, que
+# agrega cabeceras), cuando ningún hook que falle puede ya descartar la respuesta
+@app.after_request
+async def defer_admission_release(response):
+    """Una respuesta en streaming conserva su lugar de admisión hasta terminar de enviarse"""
+    slot = g.get('admission_slot')
+    if slot is not None and isinstance(response.response, IterableBody):
+        slot.deferred = True
+        response.response = AdmissionBody(response.response, slot)
+    return response
+
+@app.teardown_request
+async def release_admission(exc):
+    """Versión asíncrona de app.release_admission"""
+    slot = g.pop('admission_slot', None)
+    if slot is not None and (exc is not None or not slot.deferred):
+        slot.release()
+
+@app.after_request
+async def record_request_metrics(response):
+    """Versión asíncrona de app.record_request_metrics"""
+    start = g.get('request_start')
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule else 'sin_ruta'
+        http_request_duration.labels(request.method, route, response.status_code).observe(time.perf_counter() - start)
+    return response
+
+@app.after_request
+async def compress_response(response):
+    """Versión asíncrona de app.compress_response"""
+    if not isinstance(response.response, DataBody) or not compressible(response):
+        return response
+    
+    response.vary.add('Accept-Encoding')
+    encoding = request.accept_encodings.best_match(COMPRESSION_ENCODINGS)
+    data = await response.get_data()
+    if encoding is None or len(data) < COMPRESSION_MIN_SIZE:
+        return response
+    
+    response.set_data(compress_body(data, encoding))
+    mark_compressed(response, encoding)
+    return response
+
+async def db_session():
+    """Versión asíncrona de app.db_session"""
+    if 'db_session' not in g:
+        g.db_session = await client.start_session(causal_consistency=True)
+        advance_session(g.db_session, request.headers.get(CAUSAL_TOKEN_HEADER))
+    return g.db_session
+
+@app.after_request
+async def attach_causal_token(response):
+    """Versión asíncrona de app.attach_causal_token"""
+    session = g.get('db_session')
+    if session is not None and session.operation_time is not None:
+        response.headers[CAUSAL_TOKEN_HEADER] = encode_causal_token(session)
+    return response
+
+@app.teardown_request
+async def end_db_session(exc):
+    """Versión asíncrona de app.end_db_session"""
+    session = g.pop('db_session', None)
+    if session is not None:
+        await session.end_session()
+
+# Control de admisión: los límites por usuario se comparten con app.py, el límite
+# global usa un semáforo del event loop
+class AsyncConcurrencyLimiter:
+    """Límite de peticiones en curso del event loop, con una cola de espera corta y acotada"""
+    
+    def __init__(self, limit, queue_size, timeout):
+        self.limit = limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.waiting = 0
+        self._semaphore = asyncio.Semaphore(max(limit, 1))
+    
+    async def acquire(self):
+        """Ocupa un lugar. Retorna False si la cola está llena o se agotó la espera"""
+        if self.limit <= 0:
+            return True
+        
+        if not self._semaphore.locked():
+            await self._semaphore.acquire()
+            return True
+        
+        if self.waiting >= self.queue_size:
+            return False
+        
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self.waiting -= 1
+    
+    def release(self):
+        """Libera un lugar"""
+        if self.limit > 0:
+            self._semaphore.release()
+
+concurrency_limiter = AsyncConcurrencyLimiter(MAX_IN_FLIGHT, ADMISSION_QUEUE_SIZE, ADMISSION_QUEUE_TIMEOUT)
+# Los suscriptores SSE tienen un límite propio y sin cola, como en app.py
+stream_limiter = AsyncConcurrencyLimiter(SSE_MAX_CONNECTIONS, 0, 0)
+
+def rate_limited(retry_after):
+    """Respuesta 429 para un usuario que excedió su límite"""
+    return jsonify({
+        'success': False,
+        'message': 'Límite de peticiones excedido, intente más tarde'
+    }), 429, {'Retry-After': retry_after}
+
+def overloaded(kind):
+    """Respuesta 503 cuando el servicio no admite más peticiones en curso"""
+    admission_rejections.labels(kind, 'overload').inc()
+    return jsonify({
+        'success': False,
+        'message': 'Servicio saturado, intente más tarde'
+    }), 503, {'Retry-After': str(ADMISSION_RETRY_AFTER)}
+
+def require_auth(f):
+    """Decorador para rutas protegidas; aplica también el control de admisión"""
+    @functools.wraps(f)
+    async def decorated_function(*args, **kwargs):
+        auth_header = request.headers.get('Authorization')
+        if not auth_header:
+            return jsonify({'success': False, 'message': 'Token requerido'}), 401
+        
+        decoded, error = verify_token(auth_header)
+        if error:
+            return jsonify({'success': False, 'message': error}), 401
+        
+        request.user = decoded
+        
+        kind = route_class(request.endpoint, request.method)
+        retry_after = rate_limit_retry_after(decoded.get('id') or request.remote_addr, kind)
+        if retry_after:
+            return rate_limited(retry_after)
+        
+        limiter = stream_limiter if request.endpoint in LONG_LIVED_ROUTES else concurrency_limiter
+        if not await limiter.acquire():
+            return overloaded(kind)
+        g.admission_slot = AdmissionSlot(limiter)
+        
+        return await f(*args, **kwargs)
+    
+    return decorated_function
+
+def not_modified(etag):
+    """Respuesta 304 para peticiones condicionales con If-None-Match"""
+    response = Response('', status=304)
+    response.set_etag(etag)
+    return response
+
+async def apply_rollups(changes, session=None):
+    """Versión asíncrona de app.apply_rollups"""
+    operations = rollup_updates(changes)
+    if operations:
+        await rollups_collection.bulk_write(operations, ordered=False, session=session)
+
+async def invoices_inserted(invoices, session=None):
+    """Versión asíncrona de app.invoices_inserted"""
+    await apply_rollups(((invoice, 1) for invoice in invoices), session=session)
+    for invoice in invoices:
+        publish_event('create', invoice)
+
+async def update_invoice_tracked(invoice_id, update, session=None):
+    """Versión asíncrona de app.update_invoice_tracked"""
+    while True:
+        previous = await invoices_collection.find_one({'_id': invoice_id}, ROLLUP_FIELDS, session=session)
+        if previous is None:
+            return None
+        
+        invoice = await invoices_collection.find_one_and_update(
+            rollup_guard(previous),
+            update,
+            return_document=ReturnDocument.AFTER,
+            session=session
+        )
+        if invoice is not None:
+            await apply_rollups([(previous, -1), (invoice, 1)], session=session)
+            return invoice
+
+async def count_invoices(query, include_archived=False, session=None):
+    """Versión asíncrona de app.count_invoices"""
+    collections = [invoices_reads, invoices_archive_reads] if include_archived else [invoices_reads]
+    if not query:
+        return sum([await collection.estimated_document_count() for collection in collections])
+    
+    key = count_key(query, include_archived)
+    total = count_cache.get(key)
+    if total is None:
+        total = sum([await collection.count_documents(query, session=session) for collection in collections])
+        count_cache.put(key, total)
+    return total
+
+async def read_ndjson_records(body):
+    """Versión asíncrona de app.iter_ndjson_records: lee el cuerpo por bloques, sin cargarlo completo"""
+    pending = b''
+    async for data in body:
+        lines = (pending + data).split(b'\n')
+        pending = lines.pop()
+        for record in iter_ndjson_records(lines):
+            yield record
+    for record in iter_ndjson_records([pending]):
+        yield record
+
+async def json_records(data):
+    """Registros de un arreglo JSON con la forma (registro, error) de read_ndjson_records"""
+    for record in data:
+        yield record, None
+
+async def bulk_insert(collection, records, validate, build, chunk_size, on_insert=None, session=None):
+    """Versión asíncrona de app.bulk_insert; records es un iterable asíncrono"""
+    results = []
+    chunk, positions = [], []
+    
+    async def flush():
+        failed, unconfirmed = {}, None
+        try:
+            await collection.insert_many(chunk, ordered=False, session=session)
+        except BulkWriteError as e:
+            failed, unconfirmed = bulk_write_failures(e)
+        
+        for offset, (position, document) in enumerate(zip(positions, chunk)):
+            if offset in failed:
+                results[position] = {'index': position, 'success': False, 'message': failed[offset]}
+            elif unconfirmed:
+                # Probablemente escrito en el primario: se informa el _id para que el cliente lo verifique
+                results[position] = {'index': position, 'success': False, 'message': unconfirmed, '_id': str(document['_id'])}
+            else:
+                results[position] = {'index': position, 'success': True, '_id': str(document['_id'])}
+        
+        if on_insert:
+            await on_insert([document for offset, document in enumerate(chunk) if offset not in failed], session=session)
+        chunk.clear()
+        positions.clear()
+    
+    async for record, error in records:
+        # Cada registro agrega exactamente un resultado
+        position = len(results)
+        error = error or validate(record)
+        if error:
+            results.append({'index': position, 'success': False, 'message': error})
+            continue
+        
+        try:
+            document = build(record)
+        except Exception as e:
+            results.append({'index': position, 'success': False, 'message': str(e)})
+            continue
+        
+        results.append(None)
+        chunk.append(document)
+        positions.append(position)
+        if len(chunk) >= chunk_size:
+            await flush()
+    
+    if chunk:
+        await flush()
+    
+    return results
+
+async def export_rows(cursor, export_format, columns):
+    """Versión asíncrona de app.export_rows"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    
+    try:
+        if export_format == 'csv':
+            writer.writerow(columns)
+        
+        count = 0
+        async for document in cursor:
+            count += 1
+            if export_format == 'csv':
+                writer.writerow([_csv_value(document.get(column)) for column in columns])
+            else:
+                buffer.write(json.dumps(document, default=_json_default, ensure_ascii=False))
+                buffer.write('\n')
+            
+            if count % EXPORT_BATCH_SIZE == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        
+        yield buffer.getvalue()
+    finally:
+        await cursor.close()
+
+async def stream_events(sequence, reset, filters):
+    """Versión asíncrona de app.stream_events: consulta el broker sin bloquear el event loop"""
+    yield 'retry: 3000\n\n'
+    if reset:
+        yield format_reset(sequence)
+    
+    idle = 0
+    while True:
+        events = event_broker.events_after(sequence)
+        if not events:
+            await asyncio.sleep(SSE_POLL_INTERVAL)
+            idle += SSE_POLL_INTERVAL
+            if idle >= SSE_HEARTBEAT:
+                yield ': keepalive\n\n'
+                idle = 0
+            continue
+        
+        idle = 0
+        for event in events:
+            sequence = event['seq']
+            if event_matches(event, filters):
+                yield format_sse(event)
+
+# ==================== RUTAS ====================
+
+@app.route('/api/health', methods=['GET'])
+async def health():
+    """Verificar que el servicio está corriendo"""
+    return jsonify({
+        'success': True,
+        'message': 'Microservicio de Facturación funcionando',
+        'timestamp': utcnow()
+    })
+
+@app.route('/api/invoices', methods=['GET'])
+@require_auth
+async def list_invoices():
+    """Listar todas las facturas con filtros"""
+    try:
+        # Parámetros de filtro
+        page = request.args.get('page', 1, type=int)
+        per_page = min(request.args.get('per_page', 10, type=int), MAX_PER_PAGE)
+        cursor = request.args.get('cursor')  # presente (aunque vacío) activa el modo cursor
+        include_archived = request.args.get('include_archived') == 'true'
+        with_total = request.args.get('with_total') != 'false'  # false: solo has_more, sin contar
+        if page < 1 or per_page < 1:
+            return jsonify({
+                'success': False,
+                'message': 'page y per_page deben ser mayores que 0'
+            }), 400
+        
+        # Construcción de filtro
+        query = build_list_query(request.args)
+        date_range, error = parse_date_range(request.args)
+        if error:
+            return jsonify({
+                'success': False,
+                'message': error
+            }), 400
+        if date_range:
+            query['fecha_creacion'] = date_range
+        
+        # Búsqueda libre sobre el índice de texto (q=); los resultados se ordenan por relevancia
+        search = request.args.get('q', '').strip()
+        if len(search) > SEARCH_MAX_LENGTH:
+            return jsonify({
+                'success': False,
+                'message': f'q no puede superar {SEARCH_MAX_LENGTH} caracteres'
+            }), 400
+        if search:
+            query['$text'] = {'$search': search}
+        cursor_field = 'relevancia' if search else 'fecha_creacion'
+        
+        # Proyección de campos solicitados (fields=a,b,c)
+        projection, error = parse_fields(request.args.get('fields'))
+        if error:
+            return jsonify({
+                'success': False,
+                'message': error
+            }), 400
+        
+        # Paginación por cursor: cada página cuesta lo mismo sin importar su profundidad
+        if cursor is not None:
+            position = None
+            if cursor:
+                position = decode_cursor(cursor, cursor_field)
+                if position is None:
+                    return jsonify({
+                        'success': False,
+                        'message': 'Cursor inválido'
+                    }), 400
+            
+            # La clave de orden es necesaria para generar el siguiente cursor
+            if projection and not search:
+                projection['fecha_creacion'] = 1
+            
+            if include_archived:
+                invoices = await invoices_reads.aggregate(build_archive_pipeline(query, projection, search, position, limit=per_page + 1), session=await db_session()).to_list(None)
+            elif search:
+                invoices = await invoices_reads.aggregate(build_search_pipeline(query, projection, position, limit=per_page + 1), session=await db_session()).to_list(None)
+            else:
+                if position:
+                    query = apply_cursor(query, *position)
+                invoices = await invoices_reads.find(query, projection, session=await db_session()).sort(CURSOR_SORT).limit(per_page + 1).to_list(None)
+            
+            has_more = len(invoices) > per_page
+            invoices = invoices[:per_page]
+            next_cursor = encode_cursor(invoices[-1], cursor_field) if has_more else None
+            
+            return jsonify({
+                'success': True,
+                'message': 'Facturas obtenidas correctamente',
+                'data': invoices,
+                'pagination': {
+                    'per_page': per_page,
+                    'next_cursor': next_cursor,
+                    'has_more': has_more
+                }
+            }), 200
+        
+        # Paginación por offset, con el mismo orden estable que el modo cursor
+        skip = (page - 1) * per_page
+        limit = per_page if with_total else per_page + 1
+        
+        if include_archived:
+            invoices = await invoices_reads.aggregate(build_archive_pipeline(query, projection, search, skip=skip, limit=limit), session=await db_session()).to_list(None)
+        elif search:
+            invoices = await invoices_reads.aggregate(build_search_pipeline(query, projection, skip=skip, limit=limit), session=await db_session()).to_list(None)
+        else:
+            invoices = await invoices_reads.find(query, projection, session=await db_session()).sort(CURSOR_SORT).skip(skip).limit(limit).to_list(None)
+        
+        if not with_total:
+            return jsonify({
+                'success': True,
+                'message': 'Facturas obtenidas correctamente',
+                'data': invoices[:per_page],
+                'pagination': {
+                    'page': page,
+                    'per_page': per_page,
+                    'has_more': len(invoices) > per_page
+                }
+            }), 200
+        
+        total = await count_invoices(query, include_archived, await db_session())
+        
+        return jsonify({
+            'success': True,
+            'message': 'Facturas obtenidas correctamente',
+            'data': invoices,
+            'pagination': {
+                'page': page,
+                'per_page': per_page,
+                'total': total,
+                'pages': (total + per_page - 1) // per_page
+            }
+        }), 200
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/api/invoices', methods=['POST'])
+@require_auth
+async def create_invoice():
+    """Crear nueva factura"""
+    try:
+        data = await request.get_json()
+        
+        # Validación
+        error = validate_invoice(data)
+        if error:
+            return jsonify({
+                'success': False,
+                'message': error
+            }), 400
+        
+        # Crear factura
+        invoice = build_invoice(data, request.user.get('id'))
+        
+        result = await invoices_collection.insert_one(invoice, session=await db_session())
+        invoice['_id'] = str(result.inserted_id)
+        await apply_rollups([(invoice, 1)], session=await db_session())
+        publish_event('create', invoice)
+        
+        return jsonify({
+            'success': True,
+            'message': 'Factura creada exitosamente',
+            'data': invoice
+        }), 201
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/api/invoices/export', methods=['GET'])
+@require_auth
+async def export_invoices():
+    """Exportar las facturas filtradas como NDJSON o CSV (streaming)"""
+    try:
+        export_format = request.args.get('format', 'ndjson')
+        if export_format not in EXPORT_MIMETYPES:
+            return jsonify({
+                'success': False,
+                'message': 'Formato inválido. Debe ser: ndjson, csv'
+            }), 400
+        
+        query = build_list_query(request.args)
+        date_range, error = parse_date_range(request.args)
+        if error:
+            return jsonify({
+                'success': False,
+                'message': error
+            }), 400
+        if date_range:
+            query['fecha_creacion'] = date_range
+        # Sin sesión causal: el cuerpo se transmite después de cerrar la petición
+        cursor = invoices_reads.find(query, batch_size=EXPORT_BATCH_SIZE)
+        
+        return Response(
+            export_rows(cursor, export_format, EXPORT_COLUMNS),
+            mimetype=EXPORT_MIMETYPES[export_format],
+            headers={'Content-Disposition': f'attachment; filename=invoices.{export_format}'}
+        )
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/api/invoices/bulk', methods=['POST'])
+@require_auth
+async def bulk_create_invoices():
+    """Crear facturas en lote (arreglo JSON o NDJSON)"""
+    try:
+        chunk_size = max(request.args.get('chunk_size', BULK_CHUNK_SIZE, type=int), 1)
+        
+        if request.mimetype in NDJSON_MIMETYPES:
+            records = read_ndjson_records(request.body)
+        else:
+            data = await request.get_json(silent=True)
+            if not isinstance(data, list):
+                return jsonify({
+                    'success': False,
+                    'message': 'Se esperaba un arreglo JSON o un cuerpo NDJSON'
+                }), 400
+            records = json_records(data)
+        
+        build = functools.partial(build_invoice, user_id=request.user.get('id'))
+        results = await bulk_insert(invoices_collection, records, validate_invoice, build, chunk_size, invoices_inserted, await db_session())
+        inserted = sum(1 for result in results if result['success'])
+        failed = len(results) - inserted
+        
+        return jsonify({
+            'success': failed == 0,
+            'message': f'{inserted} facturas creadas, {failed} con errores',
+            'data': {
+                'inserted': inserted,
+                'failed': failed,
+                'results': results
+            }
+        }), 201 if failed == 0 else 207
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/api/invoices/batch-get', methods=['POST'])
+@require_auth
+async def batch_get_invoices():
+    """Obtener varias facturas por id, número o cliente en una sola consulta, en el orden pedido"""
+    try:
+        data = await request.get_json(silent=True)
+        field, values, error = parse_batch_get(data)
+        if error:
+            return jsonify({
+                'success': False,
+                'message': error
+            }), 400
+        
+        projection, error = parse_fields(request.args.get('fields'))
+        if error:
+            return jsonify({
+                'success': False,
+                'message': error
+            }), 400
+        if projection:
+            projection[field] = 1
+        
+        # Por cliente puede haber muchos documentos: se entregan los más recientes
+        # hasta BATCH_GET_MAX y se indica si quedaron más
+        cursor = invoices_collection.find(batch_get_query(field, values), projection)
+        if field == 'cliente_id':
+            cursor = cursor.sort(CURSOR_SORT)
+        invoices = await cursor.limit(BATCH_GET_MAX + 1).to_list(None)
+        truncated = len(invoices) > BATCH_GET_MAX
+        invoices, missing = order_batch(invoices[:BATCH_GET_MAX], field, values)
+        
+        return jsonify({
+            'success': True,
+            'message': 'Facturas obtenidas correctamente',
+            'data': invoices,
+            'missing': missing,
+            'truncated': truncated
+        }), 200
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/api/invoices/report', methods=['GET'])
+@require_auth
+async def billing_report():
+    """Totales de facturación por cliente, estado y/o mes desde los acumulados"""
+    try:
+        group_by = request.args.get('group_by', ','.join(ROLLUP_KEYS)).split(',')
+        if not group_by or any(key not in ROLLUP_KEYS for key in group_by):
+            return jsonify({
+                'success': False,
+                'message': f'group_by inválido. Debe combinar: {", ".join(ROLLUP_KEYS)}'
+            }), 400
+        
+        match = {'cantidad': {'$gt': 0}}
+        for key in ['cliente_id', 'estado']:
+            if request.args.get(key):
+                match[key] = request.args.get(key)
+        
+        # Rango de meses en formato YYYY-MM
+        months = {}
+        if request.args.get('mes_desde'):
+            months['$gte'] = request.args.get('mes_desde')
+        if request.args.get('mes_hasta'):
+            months['$lte'] = request.args.get('mes_hasta')
+        if months:
+            match['mes'] = months
+        
+        # Los acumulados se construyen al arrancar o con rebuild-rollups, nunca aquí
+        if await rollups_collection.estimated_document_count() == 0 and await invoices_collection.estimated_document_count() > 0:
+            return rollups_unavailable()
+        
+        groups = await rollups_reads.aggregate([
+            {'$match': match},
+            {'$group': {
+                '_id': {key: f'${key}' for key in group_by},
+                'cantidad': {'$sum': '$cantidad'},
+                **{field: {'$sum': f'${field}'} for field in ROLLUP_AMOUNTS}
+            }},
+            {'$sort': {f'_id.{key}': 1 for key in group_by}}
+        ], session=await db_session()).to_list(None)
+        
+        data = [{**group.pop('_id'), **group} for group in groups]
+        
+        return jsonify({
+            'success': True,
+            'message': 'Reporte de facturación obtenido correctamente',
+            'data': data
+        }), 200
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+def rollups_unavailable():
+    """Respuesta 503 mientras los acumulados no existen"""
+    return jsonify({
+        'success': False,
+        'message': 'Los acumulados de facturación se están construyendo (o ejecute flask --app app rebuild-rollups)'
+    }), 503, {'Retry-After': str(ROLLUPS_RETRY_AFTER)}
+
+@app.route('/api/invoices/events', methods=['GET'])
+@require_auth
+async def invoice_events():
+    """Feed de cambios de facturas (Server-Sent Events)"""
+    try:
+        filters = build_list_query(request.args)
+        last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+        
+        ensure_change_watcher()
+        sequence, reset = event_broker.position(last_event_id)
+        
+        response = Response(
+            stream_events(sequence, reset, filters),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+        # Conexión de larga duración: sin el límite de tiempo de respuesta de Quart
+        response.timeout = None
+        return response
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/api/invoices/<invoice_id>', methods=['GET'])
+@require_auth
+async def get_invoice(invoice_id):
+    """Obtener una factura específica"""
+    try:
+        entry = read_cache.get(invoice_id)
+        if entry is None:
+            # Generación previa a la lectura: si una escritura la invalida mientras tanto, no se guarda
+            generation = read_cache.generation
+            invoice = await invoices_collection.find_one({'_id': ObjectId(invoice_id)})
+            
+            # Las facturas archivadas solo se buscan a pedido y no pasan por el caché
+            archived = False
+            if not invoice and request.args.get('include_archived') == 'true':
+                invoice = await invoices_archive_collection.find_one({'_id': ObjectId(invoice_id)})
+                archived = invoice is not None
+            
+            if not invoice:
+                return jsonify({
+                    'success': False,
+                    'message': 'Factura no encontrada'
+                }), 404
+            
+            invoice['_id'] = str(invoice['_id'])
+            entry = (invoice, document_etag(invoice))
+            if not archived:
+                read_cache.put(invoice_id, entry, generation=generation)
+        
+        invoice, etag = entry
+        if request.if_none_match.contains_weak(etag):
+            return not_modified(etag)
+        
+        response = jsonify({
+            'success': True,
+            'data': invoice
+        })
+        response.set_etag(etag)
+        return response, 200
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/api/invoices/<invoice_id>', methods=['PUT'])
+@require_auth
+async def update_invoice(invoice_id):
+    """Actualizar una factura"""
+    try:
+        data = await request.get_json()
+        
+        # Campos permitidos para actualizar
+        allowed_fields = ['estado', 'notas', 'fecha_pago', 'cliente_nombre']
+        update_data = {key: data[key] for key in allowed_fields if key in data}
+        
+        error = parse_date_fields(update_data, ['fecha_pago'])
+        if error:
+            return jsonify({
+                'success': False,
+                'message': error
+            }), 400
+        
+        if update_data:
+            update_data['fecha_actualizacion'] = utcnow()
+            updated_invoice = await update_invoice_tracked(ObjectId(invoice_id), {'$set': update_data}, session=await db_session())
+        else:
+            updated_invoice = await invoices_collection.find_one({'_id': ObjectId(invoice_id)}, session=await db_session())
+        
+        if not updated_invoice:
+            return jsonify({
+                'success': False,
+                'message': 'Factura no encontrada'
+            }), 404
+        
+        read_cache.delete(invoice_id)
+        updated_invoice['_id'] = str(updated_invoice['_id'])
+        publish_event('update', updated_invoice)
+        
+        return jsonify({
+            'success': True,
+            'message': 'Factura actualizada exitosamente',
+            'data': updated_invoice
+        }), 200
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/api/invoices/<invoice_id>', methods=['DELETE'])
+@require_auth
+async def delete_invoice(invoice_id):
+    """Eliminar una factura"""
+    try:
+        invoice = await invoices_collection.find_one_and_delete({'_id': ObjectId(invoice_id)}, session=await db_session())
+        if not invoice:
+            return jsonify({
+                'success': False,
+                'message': 'Factura no encontrada'
+            }), 404
+        
+        read_cache.delete(invoice_id)
+        await apply_rollups([(invoice, -1)], session=await db_session())
+        publish_event('delete', invoice)
+        
+        return jsonify({
+            'success': True,
+            'message': 'Factura eliminada exitosamente'
+        }), 200
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/api/invoices/<invoice_id>/pay', methods=['PATCH'])
+@require_auth
+async def mark_as_paid(invoice_id):
+    """Marcar factura como pagada"""
+    try:
+        now = utcnow()
+        payment = {
+            'estado': 'pagada',
+            'fecha_pago': now,
+            'fecha_actualizacion': now
+        }
+        updated_invoice = await update_invoice_tracked(ObjectId(invoice_id), {'$set': payment}, session=await db_session())
+        if not updated_invoice:
+            return jsonify({
+                'success': False,
+                'message': 'Factura no encontrada'
+            }), 404
+        
+        read_cache.delete(invoice_id)
+        updated_invoice['_id'] = str(updated_invoice['_id'])
+        publish_event('pay', updated_invoice)
+        
+        return jsonify({
+            'success': True,
+            'message': 'Factura marcada como pagada',
+            'data': updated_invoice
+        }), 200
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/api/metrics', methods=['GET'])
+async def metrics():
+    """Métricas del proceso en formato de exposición de Prometheus"""
+    return Response(render_metrics(), mimetype=CONTENT_TYPE_LATEST)
+
+# ==================== MANEJO DE ERRORES ====================
+
+@app.errorhandler(404)
+async def not_found(error):
+    return jsonify({
+        'success': False,
+        'message': 'Ruta no encontrada'
+    }), 404
+
+@app.errorhandler(500)
+async def server_error(error):
+    return jsonify({
+        'success': False,
+        'message': 'Error interno del servidor'
+    }), 500
@@ -0,0 +1,77 @@
+"""Configuración de Gunicorn para producción del Microservicio de Facturación.
+
+Ejecutar con:
+    gunicorn -c gunicorn.conf.py app:app
+"""
+import multiprocessing
+import os
+import shutil
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+
+# Procesos pre-forkeados (por defecto 2 por núcleo + 1) con hilos en cada uno:
+# las peticiones pasan la mayor parte del tiempo esperando a MongoDB y el feed
+# SSE mantiene conexiones abiertas, por eso se usa el worker gthread
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', 8))
+
+# Cada suscriptor SSE ocupa un hilo mientras está conectado: por defecto se reserva
+# para ellos a lo sumo la mitad de los hilos de cada worker
+os.environ.setdefault('SSE_MAX_CONNECTIONS', str(max(threads // 2, 1)))
+
+# Una petición solo llega a require_auth cuando ya tiene un hilo: el límite global
+# debe quedar por debajo de los hilos que no reservan los suscriptores SSE, o nunca
+# rechazaría nada. Los hilos libres restantes son la cola de espera del limitador
+sse_connections = int(os.environ['SSE_MAX_CONNECTIONS'])
+os.environ.setdefault('MAX_IN_FLIGHT', str(max(threads - sse_connections, 1) if sse_connections else threads))
+
+# Conexiones aceptadas por worker: sin este tope gthread acepta hasta 1000 y las
+# encola a la espera de un hilo. Con él, el exceso queda en el backlog del socket
+# y el cliente (o el balanceador) reintenta en otra instancia
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', threads * 2))
+
+# El broker del feed de cambios vive en cada proceso: con varios workers solo el
+# change stream (requiere replica set) entrega a cada suscriptor los cambios hechos
+# en cualquier worker, con identificadores de evento válidos en todos ellos
+if workers > 1:
+    os.environ.setdefault('CHANGE_FEED_SOURCE', 'changestream')
+    if os.environ['CHANGE_FEED_SOURCE'] != 'changestream':
+        raise RuntimeError('Con varios workers se requiere CHANGE_FEED_SOURCE=changestream (o WEB_CONCURRENCY=1)')
+
+# La app se importa una vez en el maestro y los workers la heredan al hacer fork.
+# Es seguro porque el MongoClient se crea con connect=False y el maestro nunca lo
+# usa: cada worker abre su propio pool en su primera petición
+preload_app = True
+
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+graceful_timeout = 30
+keepalive = 5
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 0))
+max_requests_jitter = max_requests // 10
+accesslog = os.getenv('GUNICORN_ACCESS_LOG')
+
+# Métricas de Prometheus agregadas entre workers: debe definirse antes de importar la app
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', '/tmp/prometheus-facturacion')
+
+def on_starting(server):
+    """Limpia las métricas de ejecuciones anteriores"""
+    directory = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory, exist_ok=True)
+
+def post_worker_init(worker):
+    """El primer worker del despliegue crea los índices en segundo plano (idempotente).
+    
+    Cada worker empieza a seguir el change stream al arrancar y no con su primer
+    suscriptor, para que su historial cubra los eventos que ya vieron los demás.
+    """
+    from app import start_index_bootstrap, ensure_change_watcher
+    if worker.age == 1:
+        start_index_bootstrap()
+    ensure_change_watcher()
+
+def child_exit(server, worker):
+    """Descarta las métricas de indicadores de un worker terminado"""
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
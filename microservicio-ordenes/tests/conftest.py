@@ -0,0 +1,71 @@
+"""Configuración de las pruebas: el servicio corre sobre mongomock, sin MongoDB real"""
+import os
+import sys
+import time
+
+import jwt
+import mongomock
+import pymongo
+import pytest
+
+os.environ.update(
+    JWT_SECRET='test-secret',
+    INDEX_BOOTSTRAP='off',
+    RATE_LIMIT_READ='0',
+    RATE_LIMIT_WRITE='0',
+    RATE_LIMIT_BULK='0',
+    READ_CACHE_SIZE='0'
+)
+
+class FakeSession:
+    """Sesión causal mínima; mongomock rechaza las sesiones verdaderas, por eso evalúa a False"""
+    
+    operation_time = None
+    cluster_time = None
+    
+    def __bool__(self):
+        return False
+    
+    def advance_cluster_time(self, cluster_time):
+        self.cluster_time = cluster_time
+    
+    def advance_operation_time(self, operation_time):
+        self.operation_time = operation_time
+    
+    def end_session(self):
+        pass
+
+class MockClient(mongomock.MongoClient):
+    """MongoClient en memoria que acepta los argumentos que usa app.py"""
+    
+    def __init__(self, *args, event_listeners=None, connect=True, **kwargs):
+        super().__init__(*args, **kwargs)
+    
+    def start_session(self, causal_consistency=True):
+        return FakeSession()
+
+pymongo.MongoClient = MockClient
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as service  # noqa: E402
+
+@pytest.fixture
+def app_module():
+    return service
+
+@pytest.fixture(autouse=True)
+def clean_db():
+    """Cada prueba parte de colecciones y cachés vacíos"""
+    for name in service.db.list_collection_names():
+        service.db[name].delete_many({})
+    service.count_cache.clear()
+    yield
+
+@pytest.fixture
+def client():
+    return service.app.test_client()
+
+@pytest.fixture
+def auth_headers():
+    token = jwt.encode({'id': 1, 'exp': int(time.time()) + 3600}, 'test-secret', algorithm='HS256')
+    return {'Authorization': f'Bearer {token}'}
@@ -0,0 +1,57 @@
+import threading
+
+def test_concurrency_limiter_rechaza_con_la_cola_llena(app_module):
+    limiter = app_module.ConcurrencyLimiter(1, 0, 0)
+    assert limiter.acquire() is True
+    assert limiter.acquire() is False
+    limiter.release()
+    assert limiter.acquire() is True
+
+def test_concurrency_limiter_admite_al_que_espera_en_cola(app_module):
+    limiter = app_module.ConcurrencyLimiter(1, 1, 5)
+    limiter.acquire()
+    admitted = []
+    waiter = threading.Thread(target=lambda: admitted.append(limiter.acquire()))
+    waiter.start()
+    while limiter.waiting == 0:
+        pass
+    limiter.release()
+    waiter.join()
+    assert admitted == [True]
+    assert limiter.in_flight == 1
+
+def test_token_bucket_por_clave(app_module):
+    limiter = app_module.TokenBucketLimiter(1, 2)
+    assert limiter.acquire('a') == 0
+    assert limiter.acquire('a') == 0
+    assert limiter.acquire('a') > 0
+    assert limiter.acquire('b') == 0
+
+def test_admission_slot_libera_una_sola_vez(app_module):
+    limiter = app_module.ConcurrencyLimiter(2, 0, 0)
+    limiter.acquire()
+    slot = app_module.AdmissionSlot(limiter)
+    slot.release()
+    slot.release()
+    assert limiter.in_flight == 0
+
+def test_require_auth_responde_429_al_exceder_el_limite(app_module, client, auth_headers, monkeypatch):
+    monkeypatch.setitem(app_module.rate_limiters, 'read', app_module.TokenBucketLimiter(1, 1))
+    
+    assert client.get('/api/workorders', headers=auth_headers).status_code == 200
+    response = client.get('/api/workorders', headers=auth_headers)
+    assert response.status_code == 429
+    assert response.headers['Retry-After']
+
+def test_require_auth_responde_503_si_el_proceso_esta_saturado(app_module, client, auth_headers, monkeypatch):
+    limiter = app_module.ConcurrencyLimiter(1, 0, 0)
+    monkeypatch.setattr(app_module, 'concurrency_limiter', limiter)
+    
+    limiter.acquire()
+    response = client.get('/api/workorders', headers=auth_headers)
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == str(app_module.ADMISSION_RETRY_AFTER)
+    
+    limiter.release()
+    assert client.get('/api/workorders', headers=auth_headers).status_code == 200
+    assert limiter.in_flight == 0
@@ -0,0 +1,42 @@
+from bson import ObjectId
+
+def make_order(service, numero, cliente='c1'):
+    data = {'numero_orden': numero, 'cliente_id': cliente, 'cliente_nombre': 'Cliente', 'descripcion': 'd'}
+    document = service.build_workorder(data, user_id=1)
+    service.workorders_collection.insert_one(document)
+    return document
+
+def test_parse_batch_get_normaliza_y_deduplica_ids(app_module):
+    oid = ObjectId()
+    field, values, error = app_module.parse_batch_get({'ids': [str(oid).upper(), str(oid)]})
+    assert error is None
+    assert field == '_id'
+    assert values == [str(oid)]
+
+def test_parse_batch_get_rechaza_cuerpos_invalidos(app_module):
+    assert app_module.parse_batch_get(['x'])[2]
+    assert app_module.parse_batch_get({'ids': ['x'], 'numero_orden': ['y']})[2]
+    assert app_module.parse_batch_get({'ids': []})[2]
+    assert app_module.parse_batch_get({'ids': ['no-es-un-id']})[2]
+    assert app_module.parse_batch_get({'numero_orden': [1]})[2]
+
+def test_order_batch_respeta_el_orden_pedido(app_module):
+    documents = [{'numero_orden': 'B'}, {'numero_orden': 'A'}]
+    ordered, missing = app_module.order_batch(documents, 'numero_orden', ['A', 'X', 'B'])
+    assert [document['numero_orden'] for document in ordered] == ['A', 'B']
+    assert missing == ['X']
+
+def test_batch_get_devuelve_el_orden_pedido(app_module, client, auth_headers):
+    first = make_order(app_module, 'A')
+    second = make_order(app_module, 'B')
+    missing = str(ObjectId())
+    
+    response = client.post('/api/workorders/batch-get', headers=auth_headers, json={
+        'ids': [str(second['_id']).upper(), missing, str(first['_id'])]
+    })
+    
+    assert response.status_code == 200
+    body = response.get_json()
+    assert [document['numero_orden'] for document in body['data']] == ['B', 'A']
+    assert body['missing'] == [missing]
+    assert body['truncated'] is False
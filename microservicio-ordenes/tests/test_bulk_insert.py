@@ -0,0 +1,61 @@
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+
+def valid_order(numero):
+    return {'numero_orden': numero, 'cliente_id': 'c1', 'cliente_nombre': 'Cliente', 'descripcion': 'd'}
+
+class FailingCollection:
+    """Colección cuyo insert_many asigna los _id y luego falla con el BulkWriteError indicado"""
+    
+    def __init__(self, details):
+        self.details = details
+    
+    def insert_many(self, documents, ordered=True, session=None):
+        for document in documents:
+            document.setdefault('_id', ObjectId())
+        raise BulkWriteError(self.details)
+
+def run_bulk(service, collection, records, chunk_size=10):
+    inserted = []
+    results = service.bulk_insert(
+        collection, [(record, None) for record in records], service.validate_workorder, dict, chunk_size,
+        on_insert=lambda documents, session=None: inserted.extend(documents)
+    )
+    return results, inserted
+
+def test_reporte_por_registro_con_errores_de_escritura(app_module):
+    collection = FailingCollection({'writeErrors': [{'index': 1, 'errmsg': 'duplicado'}]})
+    results, inserted = run_bulk(app_module, collection, [valid_order('A'), valid_order('B'), {'numero_orden': 'C'}])
+    
+    assert [result['index'] for result in results] == [0, 1, 2]
+    assert results[0]['success'] is True
+    assert results[1] == {'index': 1, 'success': False, 'message': 'duplicado'}
+    assert results[2]['success'] is False and 'cliente_id' in results[2]['message']
+    assert [document['numero_orden'] for document in inserted] == ['A']
+
+def test_write_concern_deja_el_bloque_sin_confirmar(app_module):
+    collection = FailingCollection({'writeErrors': [], 'writeConcernErrors': [{'errmsg': 'waiting for replication timed out'}]})
+    results, _ = run_bulk(app_module, collection, [valid_order('A'), valid_order('B')])
+    
+    assert all(result['success'] is False for result in results)
+    assert all('sin confirmar' in result['message'] and result['_id'] for result in results)
+
+def test_fallo_sin_write_errors_no_se_reporta_como_exito(app_module):
+    results, _ = run_bulk(app_module, FailingCollection({}), [valid_order('A')])
+    assert results[0]['success'] is False
+
+def test_bulk_responde_201_si_todo_se_inserta(app_module, client, auth_headers):
+    response = client.post('/api/workorders/bulk', headers=auth_headers, json=[valid_order('A'), valid_order('B')])
+    
+    assert response.status_code == 201
+    assert response.get_json()['data']['inserted'] == 2
+    assert app_module.workorders_collection.count_documents({}) == 2
+
+def test_bulk_responde_207_con_write_concern(app_module, client, auth_headers, monkeypatch):
+    collection = FailingCollection({'writeErrors': [], 'writeConcernErrors': [{'errmsg': 'wtimeout'}]})
+    monkeypatch.setattr(app_module, 'workorders_collection', collection)
+    
+    response = client.post('/api/workorders/bulk', headers=auth_headers, json=[valid_order('A')])
+    
+    assert response.status_code == 207
+    assert response.get_json()['data']['failed'] == 1
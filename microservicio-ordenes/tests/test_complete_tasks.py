@@ -0,0 +1,18 @@
+from bson import ObjectId
+
+def test_parse_complete_tasks_deduplica(app_module):
+    task_ids, completada, error = app_module.parse_complete_tasks({'ids': ['a', 'b', 'a']})
+    assert error is None
+    assert task_ids == ['a', 'b']
+    assert completada is True
+
+def test_parse_complete_tasks_rechaza_cuerpos_invalidos(app_module):
+    assert app_module.parse_complete_tasks(['a'])[2]
+    assert app_module.parse_complete_tasks({'ids': []})[2]
+    assert app_module.parse_complete_tasks({'ids': [1]})[2]
+    assert app_module.parse_complete_tasks({'ids': ['a'], 'completada': 'si'})[2]
+
+def test_complete_tasks_responde_400_sin_objeto_json(client, auth_headers):
+    response = client.patch(f'/api/workorders/{ObjectId()}/tasks/complete', headers=auth_headers, json=['a'])
+    assert response.status_code == 400
+    assert response.get_json()['success'] is False
@@ -0,0 +1,53 @@
+from datetime import datetime, timedelta, timezone
+
+from bson import ObjectId
+
+BASE = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+def seed_orders(service, days):
+    documents = [{'numero_orden': f'N{n}', 'fecha_creacion': BASE + timedelta(days=day)} for n, day in enumerate(days)]
+    service.workorders_collection.insert_many(documents)
+    return documents
+
+def test_cursor_ida_y_vuelta(app_module):
+    document = {'_id': ObjectId(), 'fecha_creacion': BASE}
+    cursor = app_module.encode_cursor(document)
+    value, last_id = app_module.decode_cursor(cursor)
+    assert value.replace(tzinfo=timezone.utc) == BASE
+    assert last_id == document['_id']
+
+def test_decode_cursor_invalido(app_module):
+    assert app_module.decode_cursor('no-es-base64') is None
+    relevance_cursor = app_module.encode_cursor({'_id': ObjectId(), 'relevancia': 1.5}, 'relevancia')
+    assert app_module.decode_cursor(relevance_cursor) is None
+
+def test_apply_cursor_continua_despues_del_empate(app_module):
+    # Tres órdenes con la misma fecha: el _id desempata
+    seed_orders(app_module, [1, 1, 1, 0])
+    collection = app_module.workorders_collection
+    first = list(collection.find().sort(app_module.CURSOR_SORT).limit(2))
+    query = app_module.apply_cursor({}, first[-1]['fecha_creacion'], first[-1]['_id'])
+    rest = list(collection.find(query).sort(app_module.CURSOR_SORT))
+    assert {document['_id'] for document in first}.isdisjoint(document['_id'] for document in rest)
+    assert len(first) + len(rest) == 4
+
+def test_apply_cursor_conserva_el_filtro(app_module):
+    query = app_module.apply_cursor({'estado': 'pendiente'}, BASE, ObjectId())
+    assert query['$and'][0] == {'estado': 'pendiente'}
+
+def test_listado_por_cursor_recorre_todo_sin_repetir(app_module, client, auth_headers):
+    seed_orders(app_module, [3, 1, 4, 1, 5])
+    seen, cursor = [], ''
+    while cursor is not None:
+        response = client.get(f'/api/workorders?per_page=2&cursor={cursor}', headers=auth_headers)
+        body = response.get_json()
+        seen.extend(document['numero_orden'] for document in body['data'])
+        cursor = body['pagination']['next_cursor']
+    assert seen[:2] == ['N4', 'N2']
+    assert sorted(seen) == ['N0', 'N1', 'N2', 'N3', 'N4']
+
+def test_listado_por_offset_usa_el_orden_del_cursor(app_module, client, auth_headers):
+    seed_orders(app_module, [3, 1, 4, 0, 2])
+    pages = [client.get(f'/api/workorders?per_page=3&page={page}', headers=auth_headers).get_json()['data']
+             for page in (1, 2)]
+    assert [document['numero_orden'] for page in pages for document in page] == ['N2', 'N0', 'N4', 'N1', 'N3']